@@ -0,0 +1,307 @@
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import om38to13
+from om38to13 import OMGenomeTools, Position, SMAP
+
+class SyntheticSMAP:
+    """
+    Generator of SMAP files with the variant mix of a Bionano run. Breakpoints are drawn around the HG38 intervals of
+    the data directory so the annotation hits the same loci as real samples.
+    """
+    Header = ["# SMAP File Version:\t0.9",
+              "#h SmapEntryID\tQryContigID\tRefcontigID1\tRefcontigID2\tQryStartPos\tQryEndPos\tRefStartPos\tRefEndPos\tConfidence\tType\tXmapID1\tXmapID2\tLinkID\tQryStartIdx\tQryEndIdx\tRefStartIdx\tRefEndIdx\tZygosity\tGenotype\tGenotypeGroup\tRawConfidence\tRawConfidenceLeft\tRawConfidenceRight\tRawConfidenceCenter\tSVsize\tSVfreq\torientation",
+              "#f int        \tint        \tint         \tint         \tfloat      \tfloat    \tfloat      \tfloat     \tfloat \tstring \tint\tint\tint\tint\tint\tint\tint\tstring\tint\tint\tfloat\tfloat\tfloat\tfloat\tfloat\tfloat\tstring"]
+
+    #shares of rows in EXP_REFINEFINAL1.smap, an inversion takes two rows
+    Mix = [("insertion", 0.62), ("deletion", 0.30), ("duplication", 0.01), ("translocation_interchr", 0.005),
+           ("translocation_intrachr", 0.002), ("inversion", 0.063)]
+
+    def __init__(self, data_dir: str, seed: int = 13):
+        self.__random = random.Random(seed)
+        self.__anchors = SyntheticSMAP.Anchors(data_dir)
+
+    @staticmethod
+    def Anchors(data_dir: str) -> list:
+        """
+        HG38 intervals of the mapping and prediction files as (chromosome, start, end).
+        """
+        anchors = []
+        for name in ["fromHG38toCHM13-alignments", "prediction_38.bed"]:
+            with open(os.path.join(data_dir, name)) as f:
+                for line in f:
+                    values = line.strip().replace(";", "\t").split("\t")
+                    if len(values) >= 2:
+                        anchors.append(Position.ParseString(values[1]))
+        return anchors
+
+    def __breakpoint(self) -> tuple:
+        chromosome, start, end = self.__random.choice(self.__anchors)
+        margin = 20000 + (end - start)
+        return (chromosome, max(0, self.__random.uniform(start - margin, end + margin)))
+
+    def __size(self) -> float:
+        return math.exp(self.__random.uniform(math.log(500), math.log(200000)))
+
+    def __row(self, id, chromosomeA, chromosomeB, x, y, type, link=-1, orientation="NA") -> str:
+        r = self.__random
+        return "\t".join([str(id), str(r.randint(1, 5000)), str(chromosomeA), str(chromosomeB), "%.1f" % r.uniform(0, 3e6),
+                          "%.1f" % r.uniform(0, 3e6), "%.1f" % x, "%.1f" % y, "%.2f" % r.random(), type, str(r.randint(1, 9999)),
+                          str(r.randint(1, 9999)), str(link), "1", "2", "1", "2", r.choice(["heterozygous", "homozygous", "unknown"]),
+                          "1", "-1", "-1.00", "-1.00", "-1.00", "-1.00", "%.1f" % abs(y - x), "%.3f" % r.random(), orientation])
+
+    def rows(self, count: int):
+        """
+        Yields count data rows, inversions as a pair of an inversion row and its linked inversion_partial row.
+        """
+        types = [t for t, _ in SyntheticSMAP.Mix]
+        weights = [w for _, w in SyntheticSMAP.Mix]
+        id = 1
+        while id <= count:
+            type = self.__random.choices(types, weights)[0]
+            chromosome, x = self.__breakpoint()
+            if type == "inversion" and id < count:
+                y = x + self.__size()
+                yield self.__row(id, chromosome, chromosome, x, y, "inversion", id + 1)
+                yield self.__row(id + 1, chromosome, -1, y + self.__size() / 4, -1.0, "inversion_partial", id)
+                id += 2
+                continue
+
+            if type.startswith("translocation"):
+                other, y = self.__breakpoint()
+                if type.endswith("intrachr"):
+                    other = chromosome
+                yield self.__row(id, chromosome, other, x, y, type, orientation="+/+")
+            else:
+                yield self.__row(id, chromosome, chromosome, x, x + self.__size(), "insertion" if type == "inversion" else type)
+            id += 1
+
+    def write(self, path: str, count: int):
+        with om38to13.OpenText(path, "w") as f:
+            f.write("\n".join(SyntheticSMAP.Header) + "\n")
+            for row in self.rows(count):
+                f.write(row + "\n")
+
+    def writeRegions(self, path: str, count: int):
+        with open(path, "w") as f:
+            for _ in range(count):
+                chromosome, x = self.__breakpoint()
+                f.write("%s\t%d\t%d\n" % (Position.ChrFromBionano(chromosome), x, x + self.__size()))
+
+class Benchmark:
+    """
+    Runs every stage in a fresh interpreter, so lazily loaded data is not shared between stages and the peak RSS
+    of the child belongs to the stage alone.
+    """
+    Stages = ["FromFile", "Annotate", "Filter", "View"]
+    LoadStages = ["LoadArticleData", "LoadExperimentData", "LoadEmptyIntervals", "LoadAlternativeIntervals"]
+
+    @staticmethod
+    def References(data_dir: str) -> tuple:
+        return (os.path.join(data_dir, "fromHG38toCHM13-alignments"), os.path.join(data_dir, "fromCHM13toHG38-alignments"),
+                os.path.join(data_dir, "prediction_38.bed"))
+
+    @staticmethod
+    def RunStage(stage: str, smap_path: str, regions_path: str, data_dir: str, epsilon: int) -> dict:
+        """
+        Executes one stage in this process and returns its wall and CPU time and the number of processed items.
+        """
+        g12, g21, pred = Benchmark.References(data_dir)
+        out = os.devnull
+        loads = {"LoadArticleData": (OMGenomeTools.LoadArticleData, pred),
+                 "LoadExperimentData": (OMGenomeTools.LoadExperimentData, g12),
+                 "LoadEmptyIntervals": (OMGenomeTools.LoadEmptyIntervals, g21 + "-empty"),
+                 "LoadAlternativeIntervals": (OMGenomeTools.LoadAlternativeIntervals, g21 + "-alternatives")}
+
+        wall, cpu = time.perf_counter(), time.process_time()
+        if stage in loads:
+            load, path = loads[stage]
+            items = len(load(path, False))
+        elif stage == "FromFile":
+            smap = SMAP.FromFile(smap_path, epsilon)
+            items = len(smap.original())
+        elif stage == "Annotate":
+            OMGenomeTools.Annotate(smap_path, g12, g21, pred, out, epsilon)
+            items = None
+        elif stage == "Filter":
+            items = OMGenomeTools.Filter(smap_path, None, g12, g21, pred, out, epsilon)["rows"]
+        elif stage == "View":
+            reference = om38to13.ReferenceData.Load(g12, g21, pred)
+            with open(regions_path) as f, open(out, "w") as ostream:
+                regions = list(OMGenomeTools.ReadRegions(f))
+                OMGenomeTools.ViewBatch(regions, reference, ostream)
+            items = len(regions)
+        else:
+            om38to13.ExitWithPrint("Unknown stage %s." % stage)
+
+        return {"wall": time.perf_counter() - wall, "cpu": time.process_time() - cpu, "items": items}
+
+    @staticmethod
+    def Measure(stage: str, smap_path: str, regions_path: str, data_dir: str, epsilon: int) -> dict:
+        """
+        Runs the stage in a child interpreter, adds its peak RSS in bytes (None where wait4 is not available).
+        """
+        command = [sys.executable, os.path.abspath(__file__), "--stage", stage, "--smap", smap_path or "",
+                   "--regions", regions_path or "", "-w", data_dir, "-d", str(epsilon)]
+        process = subprocess.Popen(command, stdout=subprocess.PIPE)
+        output = process.stdout.read()
+        process.stdout.close()
+
+        peak = None
+        if hasattr(os, "wait4"):
+            _, status, usage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+            #ru_maxrss is in kilobytes on Linux and in bytes on macOS
+            peak = usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+        else:
+            process.wait()
+
+        if process.returncode != 0:
+            om38to13.ExitWithPrint("Stage %s failed." % stage)
+
+        result = json.loads(output)
+        result["peak_rss"] = peak
+        return result
+
+    @staticmethod
+    def Best(runs: list) -> dict:
+        best = min(runs, key=lambda r: r["wall"])
+        best["runs"] = [round(r["wall"], 6) for r in runs]
+        return best
+
+    @staticmethod
+    def Run(sizes, data_dir: str, epsilon: int = 10000, repeat: int = 1, seed: int = 13, work_dir: str = None, stages=None) -> dict:
+        stages = stages or Benchmark.LoadStages + Benchmark.Stages
+        results = {"meta": Benchmark.Meta(data_dir, epsilon, repeat, seed), "load": {}, "stages": {}}
+
+        for stage in stages:
+            if stage in Benchmark.LoadStages:
+                result = Benchmark.Best([Benchmark.Measure(stage, None, None, data_dir, epsilon) for _ in range(repeat)])
+                result["throughput"] = result["items"] / result["wall"] if result["wall"] > 0 else None
+                results["load"][stage] = result
+                Benchmark.Report(sys.stderr, stage, None, result)
+
+        with tempfile.TemporaryDirectory(dir=work_dir) as tmp:
+            for size in sizes:
+                generator = SyntheticSMAP(data_dir, seed)
+                smap_path = os.path.join(tmp, "synthetic_%d.smap" % size)
+                regions_path = os.path.join(tmp, "synthetic_%d.bed" % size)
+                generator.write(smap_path, size)
+                generator.writeRegions(regions_path, size)
+
+                for stage in stages:
+                    if stage in Benchmark.LoadStages:
+                        continue
+                    result = Benchmark.Best([Benchmark.Measure(stage, smap_path, regions_path, data_dir, epsilon) for _ in range(repeat)])
+                    result["rows"] = size
+                    result["throughput"] = size / result["wall"] if result["wall"] > 0 else None
+                    results["stages"].setdefault(stage, []).append(result)
+                    Benchmark.Report(sys.stderr, stage, size, result)
+
+                os.remove(smap_path)
+                os.remove(regions_path)
+
+        for stage, curve in results["stages"].items():
+            results["stages"][stage] = {"curve": curve, "exponent": Benchmark.Exponent(curve)}
+        return results
+
+    @staticmethod
+    def Exponent(curve: list) -> float:
+        """
+        Largest log-log slope of the wall time between consecutive sizes, about 1 for linear and 2 for quadratic stages.
+        """
+        slopes = []
+        for a, b in zip(curve, curve[1:]):
+            if a["wall"] > 0 and b["wall"] > 0 and b["rows"] > a["rows"]:
+                slopes.append(math.log(b["wall"] / a["wall"]) / math.log(b["rows"] / a["rows"]))
+        return round(max(slopes), 3) if len(slopes) > 0 else None
+
+    @staticmethod
+    def Meta(data_dir: str, epsilon: int, repeat: int, seed: int) -> dict:
+        try:
+            revision = subprocess.run(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                      capture_output=True, text=True).stdout.strip() or None
+        except OSError:
+            revision = None
+        return {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(), "platform": platform.platform(),
+                "cpus": os.cpu_count(), "revision": revision, "data_dir": data_dir, "distance": epsilon, "repeat": repeat, "seed": seed}
+
+    @staticmethod
+    def Report(ostream, stage: str, size, result: dict):
+        peak = "-" if result["peak_rss"] == None else "%.1f MB" % (result["peak_rss"] / 1e6)
+        throughput = "-" if result["throughput"] == None else "%.0f/s" % result["throughput"]
+        ostream.write("%-26s %9s %10.3fs wall %10.3fs cpu %14s %12s\n" % (stage, "-" if size == None else size, result["wall"], result["cpu"], throughput, peak))
+
+    @staticmethod
+    def Compare(ostream, results: dict, baseline: dict, threshold: float = 1.2) -> list:
+        """
+        Writes the wall time ratios against a previous result file and returns the stages slower than threshold.
+        """
+        regressions = []
+        def check(name, size, new, old):
+            if new["wall"] <= 0 or old["wall"] <= 0:
+                return
+            ratio = new["wall"] / old["wall"]
+            slower = ratio > threshold
+            ostream.write("%-26s %9s %8.2fx%s\n" % (name, "-" if size == None else size, ratio, " REGRESSION" if slower else ""))
+            if slower:
+                regressions.append((name, size, ratio))
+
+        for stage, result in results["load"].items():
+            if stage in baseline.get("load", {}):
+                check(stage, None, result, baseline["load"][stage])
+        for stage, result in results["stages"].items():
+            old = {r["rows"]: r for r in baseline.get("stages", {}).get(stage, {}).get("curve", [])}
+            for point in result["curve"]:
+                if point["rows"] in old:
+                    check(stage, point["rows"], point, old[point["rows"]])
+        return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="benchmark", description="Benchmark of the om38to13 stages on synthetic SMAP files of growing size.")
+    parser.add_argument("-s", "--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="Specify the numbers of SMAP rows, e.g. 1000 10000 100000 1000000")
+    parser.add_argument("-w", "--data_dir", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"), help="Specify directory with default data")
+    parser.add_argument("-d", "--distance", type=int, default=10000, help="Specify the distance for acceptation of translocation")
+    parser.add_argument("-o", "--output", help="Specify the path of the JSON results, printed to the console if not provided")
+    parser.add_argument("-r", "--repeat", type=int, default=1, help="Specify the number of runs of each stage, the fastest is reported")
+    parser.add_argument("--seed", type=int, default=13, help="Specify the seed of the synthetic SMAP generator")
+    parser.add_argument("--only", nargs="+", choices=Benchmark.LoadStages + Benchmark.Stages, help="Specify the stages to run")
+    parser.add_argument("--compare", help="Specify a previous JSON result file to report the slowdown against")
+    parser.add_argument("--threshold", type=float, default=1.2, help="Specify the wall time ratio reported as a regression")
+    parser.add_argument("--generate", type=int, help="Only write a synthetic SMAP with this number of rows to --output")
+    parser.add_argument("--tmp", help="Specify the directory of the generated files")
+    parser.add_argument("--stage", help=argparse.SUPPRESS)
+    parser.add_argument("--smap", help=argparse.SUPPRESS)
+    parser.add_argument("--regions", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.stage != None:
+        print(json.dumps(Benchmark.RunStage(args.stage, args.smap, args.regions, args.data_dir, args.distance)))
+        exit(0)
+
+    if args.generate != None:
+        if args.output == None:
+            om38to13.ExitWithPrint("The --generate option requires --output.")
+        SyntheticSMAP(args.data_dir, args.seed).write(args.output, args.generate)
+        exit(0)
+
+    results = Benchmark.Run(sorted(args.sizes), args.data_dir, args.distance, args.repeat, args.seed, args.tmp, args.only)
+    if args.output == None:
+        print(json.dumps(results, indent=2))
+    else:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare != None:
+        with open(args.compare) as f:
+            regressions = Benchmark.Compare(sys.stderr, results, json.load(f), args.threshold)
+        exit(1 if len(regressions) > 0 else 0)
+    exit(0)
@@ -1,12 +1,97 @@
 import argparse
+import array
+import bisect
+import collections
+import contextlib
+import cProfile
 import enum
+import glob
+import gzip
+import hashlib
+import http.server
+import io
+import itertools
+import json
 import math
+import mmap
+import multiprocessing
 import os
+import pstats
 import re
+import socketserver
+import sqlite3
+import sys
+import threading
+import time
+import urllib.parse
+import zlib
+
+try:
+    import resource
+except ImportError:
+    resource = None
 
 def ExitWithPrint(msg: str):
-    print(msg)
-    exit(1)    
+    #the interpreter prints the message to stderr, stdout may carry the filtered smap or other results
+    #callers that survive the exit, the cohort workers and the query server, read it from the exception
+    raise SystemExit(msg)
+
+def IsSMAPPath(path: str) -> bool:
+    return path.lower().endswith(".smap") or path.lower().endswith(".smap.gz")
+
+def IsSamePath(path: str, other: str) -> bool:
+    if path == "-" or other == "-":
+        return False
+    if os.path.exists(path) and os.path.exists(other):
+        return os.path.samefile(path, other)
+    return os.path.realpath(path) == os.path.realpath(other)
+
+def OpenText(path: str, mode: str = "r"):
+    """
+    Opens a text file for reading or writing, .gz files are read as gzip and written as block compressed gzip
+    which SMAPIndex can access randomly.
+    """
+    if mode == "r":
+        return gzip.open(path, "rt") if path.lower().endswith(".gz") else open(path, mode)
+
+    stream = BlockGzipWriter(path) if path.lower().endswith(".gz") else open(path, mode, buffering=OMGenomeTools.WriteBuffer)
+    return stream if RunStats.Active == None else TimedWriter(stream, RunStats.Active)
+
+class BlockGzipWriter:
+    """
+    Text writer producing a gzip file made of independent members of about BlockSize uncompressed bytes (as bgzip does).
+    Every gzip reader decompresses it as a whole, the members allow seeking to a row without decompressing the file.
+    """
+    BlockSize = 1 << 16
+
+    def __init__(self, path: str):
+        self.__file = open(path, "wb")
+        self.__buffer = []
+        self.__size = 0
+
+    def write(self, text: str):
+        data = text.encode()
+        self.__buffer.append(data)
+        self.__size += len(data)
+        if self.__size >= BlockGzipWriter.BlockSize:
+            self.flush()
+
+    def flush(self):
+        if self.__size > 0:
+            self.__file.write(gzip.compress(b"".join(self.__buffer), mtime=0))
+            self.__buffer = []
+            self.__size = 0
+
+    def close(self):
+        if not self.__file.closed:
+            self.flush()
+            self.__file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
 
 messages = ["(Reversed)", 
             "no mapping from HG38 to CHM13", 
@@ -16,6 +101,8 @@ messages = ["(Reversed)",
             "in CHM13 have multiple sources in HG38"]
 
 class Position:
+    __slots__ = ("__chromosome", "__start", "__end")
+
     def __init__(self, chromosome: int, start: float, end: float):
         self.__chromosome = chromosome
         self.__start = start
@@ -61,9 +148,9 @@ class Position:
         return Position(self.__chromosome, max(self.__start, position.start()), min(self.__end, position.end()))
 
     def overlapWith(self, position: 'Position') -> bool:
-        if(self.__chromosome != position.chromosome()):
+        if(self.__chromosome != position.__chromosome):
             return False
-        return self.__start <= position.end() and position.start() <= self.__end
+        return self.__start <= position.__end and position.__start <= self.__end
 
 
     def tString(self, epsilon):
@@ -77,6 +164,14 @@ class Position:
 
     @staticmethod
     def FromString(s: str) -> 'Position':
+        return Position(*Position.ParseString(s))
+
+    @staticmethod
+    def ParseString(s: str) -> tuple:
+        """
+        Parses chr:pos or chr:start-end into a (chromosome, start, end) tuple without creating a Position.
+        """
+        if RunStats.Active != None: RunStats.Active.count("position parses")
         chr_pos_reobj = re.match(r'(.+):(((\d+)-(\d+))|((\d+)))', s)
         if chr_pos_reobj == None:
             ExitWithPrint("Incorrectly specified position: " + s + ". It should match either chr:pos or chr:start-end.")
@@ -85,12 +180,12 @@ class Position:
         if pos12_obj == None:
             #single position
             s_pos = int(chr_pos_reobj.group(2))
-            return Position(Position.ChrToBionano(chr_pos_reobj.group(1)), s_pos, s_pos)
+            return (Position.ChrToBionano(chr_pos_reobj.group(1)), s_pos, s_pos)
         else:
             #start and end positions differs
             start_pos = int(pos12_obj.group(1))
             end_pos = int(pos12_obj.group(2))
-            return Position(Position.ChrToBionano(chr_pos_reobj.group(1)), start_pos, end_pos)
+            return (Position.ChrToBionano(chr_pos_reobj.group(1)), start_pos, end_pos)
 
     @staticmethod
     def ChrToBionano(chromosome: str) -> int:
@@ -111,6 +206,549 @@ class Position:
         else:
             return "chr%d" % chromosome
 
+class PositionArray:
+    """
+    Columnar store of positions: int8 chromosomes and start/end columns of the given typecode, "q" for the integer
+    reference coordinates and "d" for smap coordinates. Chromosome 0 marks a missing position.
+    Only the storage is columnar, elements are materialized as Position on access.
+    """
+    __slots__ = ("__chromosomes", "__starts", "__ends")
+
+    def __init__(self, typecode: str = "q", chromosomes=None, starts=None, ends=None):
+        self.__chromosomes = array.array("b") if chromosomes == None else chromosomes
+        self.__starts = array.array(typecode) if starts == None else starts
+        self.__ends = array.array(typecode) if ends == None else ends
+
+    def chromosomes(self):
+        return self.__chromosomes
+
+    def starts(self):
+        return self.__starts
+
+    def ends(self):
+        return self.__ends
+
+    def append(self, chromosome: int, start, end):
+        self.__chromosomes.append(chromosome)
+        self.__starts.append(start)
+        self.__ends.append(end)
+
+    def __len__(self) -> int:
+        return len(self.__chromosomes)
+
+    def __getitem__(self, i: int) -> 'Position':
+        chromosome = self.__chromosomes[i]
+        if chromosome == 0:
+            return None
+        return Position(chromosome, self.__starts[i], self.__ends[i])
+
+    def __iter__(self):
+        for i in range(len(self.__chromosomes)):
+            yield self[i]
+
+class PositionRows:
+    """
+    Sequence of reference dataset rows stored as PositionArray columns, rows are materialized on first access and
+    kept for later queries: article (label, hg38, chm13), experiment (IntervalType, hg38, chm13 or None),
+    empty Position and alternatives (chm13, hg38 source, hg38 source).
+    """
+    def __init__(self, kind: str, arrays, codes=None, labels=None):
+        self.__kind = kind
+        self.__arrays = arrays
+        self.__codes = codes
+        self.__labels = labels
+        self.__rows = [None] * len(arrays[0])
+
+    def kind(self) -> str:
+        return self.__kind
+
+    def arrays(self) -> list:
+        return self.__arrays
+
+    def codes(self):
+        return self.__codes
+
+    def labels(self) -> list:
+        return self.__labels
+
+    def __len__(self) -> int:
+        return len(self.__arrays[0])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __getitem__(self, i: int):
+        if i < 0 or i >= len(self):
+            raise IndexError(i)
+
+        row = self.__rows[i]
+        if row == None:
+            row = self.__materialize(i)
+            self.__rows[i] = row
+        return row
+
+    def __materialize(self, i: int):
+        if self.__kind == "article":
+            return (self.__labels[self.__codes[i]], self.__arrays[0][i], self.__arrays[1][i])
+        elif self.__kind == "experiment":
+            return (IntervalType(self.__codes[i]), self.__arrays[0][i], self.__arrays[1][i])
+        elif self.__kind == "empty":
+            return self.__arrays[0][i]
+        else:
+            return (self.__arrays[0][i], self.__arrays[1][i], self.__arrays[2][i])
+
+class IntervalIndex:
+    """
+    Per-chromosome index over sorted interval starts augmented with a running maximum of ends.
+    Overlap queries cost O(log n + k) and return items in their original order.
+    """
+    def __init__(self, items, key, positions: 'PositionArray' = None):
+        """
+        Indexes items by the Position returned by key, or by the parallel positions column when given.
+        Items given together with positions are kept as they are, e.g. a lazy PositionRows sequence.
+        """
+        self.__items = items if positions != None else list(items)
+        self.__chromosomes = {}
+
+        buckets = {}
+        if positions != None:
+            for order, (chromosome, start, end) in enumerate(zip(positions.chromosomes(), positions.starts(), positions.ends())):
+                buckets.setdefault(chromosome, []).append((start, end, order))
+        else:
+            for order, item in enumerate(self.__items):
+                position = key(item)
+                buckets.setdefault(position.chromosome(), []).append((position.start(), position.end(), order))
+
+        for chromosome, entries in buckets.items():
+            self.__chromosomes[chromosome] = IntervalIndex.Bucket(entries)
+
+    @staticmethod
+    def Bucket(entries) -> tuple:
+        """
+        Sorts the (start, end, order) entries of a chromosome into the (starts, ends, max_ends, orders) columns.
+        """
+        entries.sort()
+        return (array.array("d", [e[0] for e in entries]), array.array("d", [e[1] for e in entries]),
+                IntervalIndex.RunningMax(e[1] for e in entries), array.array("q", [e[2] for e in entries]))
+
+    @staticmethod
+    def RunningMax(ends):
+        result = array.array("d")
+        running = -math.inf
+        for end in ends:
+            running = max(running, end)
+            result.append(running)
+        return result
+
+    @staticmethod
+    def Hits(bucket, start, end, lo: int = 0) -> list:
+        """
+        Returns the sorted orders of the bucket entries overlapping [start, end], entries before lo end too early.
+        """
+        starts, ends, max_ends, orders = bucket
+        #entries before lo end before the query starts, entries from hi start after the query ends
+        lo = bisect.bisect_left(max_ends, start, lo)
+        hi = bisect.bisect_right(starts, end, lo)
+        hits = [orders[i] for i in range(lo, hi) if ends[i] >= start]
+        hits.sort()
+        return hits
+
+    @staticmethod
+    def FromColumns(items, chromosomes) -> 'IntervalIndex':
+        """
+        Wraps already sorted per-chromosome columns (starts, ends, max_ends, orders), e.g. from a ReferenceBundle.
+        """
+        index = IntervalIndex([], None)
+        index.__items = items
+        index.__chromosomes = chromosomes
+        return index
+
+    def chromosomes(self) -> dict:
+        return self.__chromosomes
+
+    def items(self):
+        return self.__items
+
+    def overlapsAny(self, position: 'Position') -> bool:
+        bucket = self.__chromosomes.get(position.chromosome())
+        if bucket == None:
+            return False
+
+        #the running maximum of ends of all intervals starting before the query end decides the overlap
+        starts, _, max_ends, _ = bucket
+        hi = bisect.bisect_right(starts, position.end())
+        return hi > 0 and max_ends[hi - 1] >= position.start()
+
+    def overlappingMany(self, positions) -> list:
+        """
+        Answers overlap queries of many positions at once, the result lists follow the order of positions.
+        Queries are swept per chromosome in order of their starts so the lower bound only moves forward.
+        """
+        result = [None] * len(positions)
+        by_chromosome = {}
+        for i, position in enumerate(positions):
+            by_chromosome.setdefault(position.chromosome(), []).append(i)
+
+        for chromosome, queries in by_chromosome.items():
+            bucket = self.__chromosomes.get(chromosome)
+            if bucket == None:
+                for i in queries: result[i] = []
+                continue
+
+            max_ends = bucket[2]
+            queries.sort(key=lambda i: positions[i].start())
+            lo = 0
+            for i in queries:
+                q_start = positions[i].start()
+                lo = bisect.bisect_left(max_ends, q_start, lo)
+                result[i] = [self.__items[j] for j in IntervalIndex.Hits(bucket, q_start, positions[i].end(), lo)]
+
+        return result
+
+    def __iter__(self):
+        return iter(self.__items)
+
+    def __len__(self) -> int:
+        return len(self.__items)
+
+    def overlapping(self, position: 'Position') -> list:
+        bucket = self.__chromosomes.get(position.chromosome())
+        if bucket == None:
+            return []
+
+        return [self.__items[i] for i in IntervalIndex.Hits(bucket, position.start(), position.end())]
+
+class SMAPRowType(enum.Enum):
+        Header = 1
+        Common = 2
+        Translocation = 3
+        InversionPartial = 4
+
+class PartitionedIndex:
+    """
+    Lazily loaded reference dataset with the query interface of IntervalIndex. The dataset is opened on first use,
+    from the ReferenceBundle when it is available, otherwise the text lines are grouped by chromosome and only the
+    chromosomes touched by queries are parsed. Instances are cached per file for the lifetime of the process.
+    """
+    __cache = {}
+    __cache_lock = threading.Lock()
+
+    def __init__(self, fileName: str, kind: str):
+        self.__fileName = fileName
+        self.__name = os.path.basename(fileName)
+        self.__kind = kind
+        self.__lock = threading.Lock()
+        self.__opened = False
+        self.__bundled = None
+        self.__lines = None
+        self.__partitions = {}
+
+    def name(self) -> str:
+        return self.__name
+
+    @staticmethod
+    def Get(fileName: str, kind: str) -> 'PartitionedIndex':
+        """
+        Returns the cached lazy dataset of the file, a new one when the file changed since it was cached.
+        """
+        key = (os.path.abspath(fileName), kind)
+        stat = os.stat(fileName)
+        with PartitionedIndex.__cache_lock:
+            cached = PartitionedIndex.__cache.get(key)
+            if cached == None or cached[0] != (stat.st_size, stat.st_mtime_ns):
+                cached = ((stat.st_size, stat.st_mtime_ns), PartitionedIndex(fileName, kind))
+                PartitionedIndex.__cache[key] = cached
+            return cached[1]
+
+    def __keyField(self, ls: str) -> str:
+        if self.__kind == "empty":
+            return ls
+        elif self.__kind == "alternatives":
+            return ls.split("\t", 1)[0]
+        return ls.replace(";","\t").split("\t")[1]
+
+    def __open(self):
+        if self.__opened:
+            return
+
+        with RunStats.Stage("open reference"):
+            self.__read()
+        self.__opened = True
+
+    def __read(self):
+        self.__bundled = ReferenceBundle.Lookup(self.__fileName)
+        if self.__bundled == None:
+            #lines are only split by chromosome here, positions are parsed per partition
+            self.__lines = {}
+            with open(self.__fileName) as f:
+                for lineno, line in enumerate(f):
+                    ls = line.strip()
+                    if len(ls) == 0:
+                        continue
+                    try:
+                        chromosome = Position.ChrToBionano(self.__keyField(ls).split(":", 1)[0])
+                    except (IndexError, ValueError):
+                        OMGenomeTools.Parsers[self.__kind]([ls], self.__fileName)
+                        ExitWithPrint("Unexpected input data for %s" % self.__fileName)
+                    self.__lines.setdefault(chromosome, []).append((lineno, ls))
+
+    def partition(self, chromosome: int):
+        """
+        Returns the IntervalIndex holding the intervals of the chromosome, None if it has none.
+        """
+        with self.__lock:
+            self.__open()
+            if self.__bundled != None:
+                return self.__bundled
+            if chromosome not in self.__partitions:
+                #a bundle compiled after the dataset was opened is used for the partitions not parsed yet
+                self.__bundled = ReferenceBundle.Lookup(self.__fileName)
+                if self.__bundled != None:
+                    return self.__bundled
+                lines = self.__lines.get(chromosome)
+                if lines == None:
+                    self.__partitions[chromosome] = None
+                else:
+                    with RunStats.Stage("parse reference"):
+                        self.__partitions[chromosome] = OMGenomeTools.Parsers[self.__kind]([l for _, l in lines], self.__fileName)
+            return self.__partitions[chromosome]
+
+    def preload(self):
+        self.__open()
+        if self.__bundled == None:
+            for chromosome in list(self.__lines):
+                self.partition(chromosome)
+
+    def overlapping(self, position: 'Position') -> list:
+        index = self.partition(position.chromosome())
+        hits = [] if index == None else index.overlapping(position)
+        if RunStats.Active != None: RunStats.Active.addOverlaps(self.__name, 1, len(hits))
+        return hits
+
+    def overlapsAny(self, position: 'Position') -> bool:
+        index = self.partition(position.chromosome())
+        overlaps = index != None and index.overlapsAny(position)
+        if RunStats.Active != None: RunStats.Active.addOverlaps(self.__name, 1, int(overlaps))
+        return overlaps
+
+    def __groups(self, chromosomes):
+        groups = {}
+        for i, chromosome in enumerate(chromosomes):
+            groups.setdefault(chromosome, []).append(i)
+        return groups.items()
+
+    def overlappingMany(self, positions) -> list:
+        result = [[] for _ in positions]
+        for chromosome, indexes in self.__groups([p.chromosome() for p in positions]):
+            index = self.partition(chromosome)
+            if index != None:
+                for i, hits in zip(indexes, index.overlappingMany([positions[i] for i in indexes])):
+                    result[i] = hits
+        if RunStats.Active != None: RunStats.Active.addOverlaps(self.__name, len(positions), sum(len(hits) for hits in result))
+        return result
+
+    def __iter__(self):
+        self.__open()
+        if self.__bundled != None:
+            yield from self.__bundled
+            return
+
+        self.preload()
+        rows = []
+        for chromosome, lines in self.__lines.items():
+            rows.extend(zip((lineno for lineno, _ in lines), self.__partitions[chromosome]))
+        rows.sort(key=lambda r: r[0])
+        for _, item in rows:
+            yield item
+
+    def __len__(self) -> int:
+        self.__open()
+        if self.__bundled != None:
+            return len(self.__bundled)
+        return sum(len(lines) for lines in self.__lines.values())
+
+class SMAPIndex:
+    """
+    Sidecar index <smap>.idx of a plain or gzip compressed smap file for region queries. For every chromosome it keeps
+    the row intervals sorted by start with a running maximum of ends and the uncompressed offsets of the rows, for gzip
+    files also the compressed and uncompressed offsets of the gzip members. Rows of block compressed files (see
+    BlockGzipWriter, bgzip) are read by decompressing only the members holding them.
+    """
+    Version = 1
+
+    def __init__(self, path: str, header, members, chromosomes):
+        self.__path = path
+        self.__header = header
+        self.__members = members
+        self.__chromosomes = chromosomes
+
+    def header(self) -> list:
+        return self.__header
+
+    @staticmethod
+    def IndexPath(path: str) -> str:
+        return path + ".idx"
+
+    @staticmethod
+    def Decompress(f, start: int = 0, members=None):
+        """
+        Yields decompressed chunks of consecutive gzip members read from compressed offset start, the (compressed,
+        uncompressed) offsets of the members are appended to members when given.
+        """
+        f.seek(start)
+        consumed = start
+        produced = 0
+        data = b""
+        d = None
+        while True:
+            if len(data) == 0:
+                data = f.read(1 << 20)
+                if len(data) == 0:
+                    break
+            if d == None:
+                if members != None:
+                    members.append((consumed, produced))
+                d = zlib.decompressobj(31)
+
+            chunk = d.decompress(data)
+            if d.eof:
+                consumed += len(data) - len(d.unused_data)
+                data = d.unused_data
+                d = None
+            else:
+                consumed += len(data)
+                data = b""
+
+            produced += len(chunk)
+            if len(chunk) > 0:
+                yield chunk
+
+    @staticmethod
+    def Lines(path: str, members):
+        """
+        Yields (uncompressed offset, line) of the file.
+        """
+        with open(path, "rb") as f:
+            if path.lower().endswith(".gz"):
+                chunks = SMAPIndex.Decompress(f, 0, members)
+            else:
+                chunks = iter(lambda: f.read(1 << 20), b"")
+
+            offset = 0
+            rest = b""
+            for chunk in chunks:
+                data = rest + chunk
+                lines = data.split(b"\n")
+                rest = lines.pop()
+                for line in lines:
+                    yield (offset, line.decode())
+                    offset += len(line) + 1
+            if len(rest) > 0:
+                yield (offset, rest.decode())
+
+    @staticmethod
+    def Build(path: str, write: bool = True) -> 'SMAPIndex':
+        header = []
+        members = []
+        entries = {}
+
+        for offset, line in SMAPIndex.Lines(path, members):
+            if line.startswith("#"):
+                header.append(line.rstrip())
+                continue
+
+            values = line.strip().split("\t")
+            if len(values) < 13:
+                continue
+
+            x = float(values[6])
+            y = float(values[7])
+            if "trans" in line:
+                entries.setdefault(int(values[2]), []).append((x, x, offset))
+                entries.setdefault(int(values[3]), []).append((y, y, offset))
+            else:
+                y = x if y == -1 else y
+                entries.setdefault(int(values[2]), []).append((min(x, y), max(x, y), offset))
+
+        chromosomes = {chromosome: IntervalIndex.Bucket(rows) for chromosome, rows in entries.items()}
+
+        index = SMAPIndex(path, header, members, chromosomes)
+        if write:
+            source = ReferenceBundle.Fingerprint(path, False)
+            with open(SMAPIndex.IndexPath(path), "w") as f:
+                json.dump({"version": SMAPIndex.Version, "source": source, "header": header, "members": members,
+                           "chromosomes": {str(c): [list(column) for column in v] for c, v in chromosomes.items()}}, f)
+        return index
+
+    @staticmethod
+    def Load(path: str) -> 'SMAPIndex':
+        """
+        Returns the sidecar index of the smap, None when it is missing or the smap changed since indexing.
+        """
+        index_path = SMAPIndex.IndexPath(path)
+        if not os.path.isfile(index_path):
+            return None
+
+        with open(index_path) as f:
+            data = json.load(f)
+
+        source = ReferenceBundle.Fingerprint(path, False)
+        if data.get("version") != SMAPIndex.Version or data["source"]["size"] != source["size"] or data["source"]["mtime_ns"] != source["mtime_ns"]:
+            return None
+
+        return SMAPIndex(path, data["header"], [tuple(m) for m in data["members"]], {int(c): v for c, v in data["chromosomes"].items()})
+
+    def offsets(self, position: 'Position') -> list:
+        bucket = self.__chromosomes.get(position.chromosome())
+        if bucket == None:
+            return []
+
+        #translocation rows within one chromosome are indexed at both breakpoints
+        return sorted(set(IntervalIndex.Hits(bucket, position.start(), position.end())))
+
+    def rows(self, offsets):
+        """
+        Yields the lines starting at the given sorted uncompressed offsets.
+        """
+        with open(self.__path, "rb") as f:
+            if not self.__path.lower().endswith(".gz"):
+                for offset in offsets:
+                    f.seek(offset)
+                    yield f.readline().decode().rstrip("\r\n")
+                return
+
+            member_offsets = [m[1] for m in self.__members]
+            chunks = None
+            base = 0
+            buffer = bytearray()
+            for offset in offsets:
+                #restart at the member holding the row unless it follows shortly after the decompressed data
+                if chunks == None or offset < base or offset > base + len(buffer) + 4 * BlockGzipWriter.BlockSize:
+                    member = max(0, bisect.bisect_right(member_offsets, offset) - 1)
+                    chunks = SMAPIndex.Decompress(f, self.__members[member][0])
+                    base = self.__members[member][1]
+                    buffer = bytearray()
+
+                end = -1
+                while True:
+                    if offset - base <= len(buffer):
+                        end = buffer.find(b"\n", offset - base)
+                        if end >= 0:
+                            break
+                    chunk = next(chunks, None)
+                    if chunk == None:
+                        end = len(buffer)
+                        break
+                    buffer += chunk
+
+                yield buffer[offset - base:end].decode().rstrip("\r")
+                del buffer[:end + 1]
+                base += end + 1
+
+    def query(self, position: 'Position') -> list:
+        return list(self.rows(self.offsets(position)))
+
 class SMAP:
     def __init__(self, h_lines, original, common, translocations, inversions):
         self.__h_lines = h_lines
@@ -120,7 +758,7 @@ class SMAP:
         self.__inversions = inversions
 
     def serialize(self, outpath, smap_ids):
-        f = open(outpath, "w")
+        f = OpenText(outpath, "w")
         f.write("\n".join(self.__h_lines) + "\n")
         f.write("\n".join(list(map(lambda x: self.__original[x], smap_ids))))
         f.close()
@@ -137,72 +775,109 @@ class SMAP:
     def original(self):
         return self.__original
 
+    @staticmethod
+    def PairInversion(item, itemB):
+        """
+        Joins two linked partial inversion rows (id, link_id, chromosome, x, y) into (id, link_id, Position).
+        """
+        id, _, chromosome, x, y = item
+
+        if y == -1:
+            if x < itemB[3]: return (id, itemB[0], Position(chromosome, x, itemB[3]))
+            else: return (id, itemB[0], Position(chromosome, itemB[4], x))
+        elif itemB[4] == -1:
+            if itemB[3] < x: return (id, itemB[0], Position(chromosome, itemB[3], x))
+            else: return (id, itemB[0], Position(chromosome, y, itemB[3]))
+        else:
+            if x < itemB[3]: return (id, itemB[0], Position(chromosome, y, itemB[3]))
+            else: return (id, itemB[0], Position(chromosome, itemB[4], x))
+
+    @staticmethod
+    def ReadRows(stream, epsilon):
+        """
+        Yields (SMAPRowType, line, item) for every non-empty line of the stream.
+        Items are (id, Position) for common rows, (id, aroundA, aroundB) for translocations
+        and (id, link_id, chromosome, x, y) for partial inversion rows.
+        """
+        for line in stream:
+            if line.startswith("#"):
+                yield (SMAPRowType.Header, line.rstrip(), None)
+                continue
+
+            l = line.strip()
+            if len(l) == 0:
+                continue
+
+            values = l.split("\t")
+            if len(values) < 13: ExitWithPrint("Unexpected smap row with %d columns: %s" % (len(values), l[:80]))
+            smap_id = int(values[0])
+            link_id = int(values[12])
+
+            if link_id != -1:
+                x = float(values[6])
+                y = float(values[7])
+                if y != -1 and x > y: ExitWithPrint("Inversion: x must be smaller than y.") 
+                if x < 0: ExitWithPrint("Inversion: the first coordinate cannot be negative")
+
+                yield (SMAPRowType.InversionPartial, l, (smap_id, link_id, int(values[2]), x, y))
+            elif "trans" in l:
+                pos_a = float(values[6])
+                pos_b = float(values[7])
+                pos_a_start = 0 if pos_a - epsilon < 0 else pos_a - epsilon
+                pos_b_start = 0 if pos_b - epsilon < 0 else pos_b - epsilon
+                aroundA = Position(int(values[2]), pos_a_start, pos_a + epsilon)
+                aroundB = Position(int(values[3]), pos_b_start, pos_b + epsilon)
+                yield (SMAPRowType.Translocation, l, (smap_id, aroundA, aroundB))
+            else:
+                yield (SMAPRowType.Common, l, (smap_id, Position(int(values[2]), float(values[6]), float(values[7]))))
+
     @staticmethod
     def FromFile(smap_path, epsilon):
         if not os.path.exists(smap_path):
             ExitWithPrint("The specified smap input file does not exists.")            
 
+        with OpenText(smap_path) as f, RunStats.Stage("read smap"):
+            return SMAP.FromStream(f, epsilon)
+
+    @staticmethod
+    def FromStream(stream, epsilon):
         h_lines = []
         common = []
         translocations = []
         inversions = []
         inversions_partial = []
+        partial_by_id = {}
         original = {}
 
-        with open(smap_path) as f:            
-            for line in f.readlines():
-                if line.startswith("#"):
-                    h_lines.append(line.rstrip())
-                    continue
-
-                l = line.strip()
-                if len(l) == 0:
-                    continue
-
-                values = l.split("\t")
-                smap_id = int(values[0])
-                original[smap_id] = l
-
-                if int(values[12]) != -1:
-                    inversions_partial.append((int(values[0]), int(values[12]), int(values[2]), float(values[6]), float(values[7])))
-                elif "trans" in l:
-                    pos_a = float(values[6])
-                    pos_b = float(values[7])
-                    pos_a_start = 0 if pos_a - epsilon < 0 else pos_a - epsilon
-                    pos_b_start = 0 if pos_b - epsilon < 0 else pos_b - epsilon
-                    aroundA = Position(int(values[2]), pos_a_start, pos_a + epsilon)
-                    aroundB = Position(int(values[3]), pos_b_start, pos_b + epsilon)
-                    translocations.append((smap_id, aroundA, aroundB))
-                else:
-                    common.append((int(values[0]), Position(int(values[2]), float(values[6]), float(values[7]))))
+        for rtype, line, item in SMAP.ReadRows(stream, epsilon):
+            if rtype == SMAPRowType.Header:
+                h_lines.append(line)
+                continue
 
-        for id, link_id, chromosome, x, y in inversions_partial:
-            if y != -1 and x > y: ExitWithPrint("Inversion: x must be smaller than y.") 
-            if x < 0: ExitWithPrint("Inversion: the first coordinate cannot be negative")
+            original[item[0]] = line
 
-            def existsInversions(id: int) -> bool:
-                for item_a, item_b, _ in inversions:
-                    if item_a == id or item_b == id: return True
-                return False
+            if rtype == SMAPRowType.InversionPartial:
+                inversions_partial.append(item)
+                partial_by_id.setdefault(item[0], item)
+            elif rtype == SMAPRowType.Translocation:
+                translocations.append(item)
+            else:
+                common.append(item)
 
-            def locatePartial(linkID: int) -> bool:
-                for inversion in inversions_partial:
-                    if inversion[0] == linkID: return inversion
-                return None
+        #each inversion is reported once, at the position of its first partial row
+        paired = set()
+        for item in inversions_partial:
+            if item[0] in paired:
+                continue
 
-            if not existsInversions(id):
-                itemB = locatePartial(link_id)
+            itemB = partial_by_id.get(item[1])
+            if itemB == None: ExitWithPrint("Inversion: linked entry %d of %d not found." % (item[1], item[0]))
 
-                if y == -1:
-                    if x < itemB[3]: inversions.append((id, itemB[0], Position(chromosome, x, itemB[3])))
-                    else: inversions.append((id, itemB[0], Position(chromosome, itemB[4], x)))
-                elif itemB[4] == -1:
-                    if itemB[3] < x: inversions.append((id, itemB[0], Position(chromosome, itemB[3], x)))
-                    else: inversions.append((id, itemB[0], Position(chromosome, y, itemB[3])))
-                else:
-                    if x < itemB[3]: inversions.append((id, itemB[0], Position(chromosome, y, itemB[3])))
-                    else: inversions.append((id, itemB[0], Position(chromosome, itemB[4], x)))
+            inversions.append(SMAP.PairInversion(item, itemB))
+            paired.add(item[0])
+            paired.add(itemB[0])
 
+        if RunStats.Active != None: RunStats.Active.addVariants(len(common), len(translocations), len(inversions))
         return SMAP(h_lines, original, common, translocations, inversions)
 
 class IntervalType(enum.Enum):
@@ -215,208 +890,1704 @@ class SMAPFilterType(enum.Enum):
         Induced = 2
         Both = 3
 
+        @staticmethod
+        def FromName(name: str) -> 'SMAPFilterType':
+            modes = {"mapping": SMAPFilterType.Mapping, "induced": SMAPFilterType.Induced, "both": SMAPFilterType.Both}
+            if not isinstance(name, str) or name.lower() not in modes:
+                raise ValueError("unknown filter mode %r, use one of: %s" % (name, ", ".join(modes)))
+            return modes[name.lower()]
+
+class ReferenceBundle:
+    """
+    Binary columnar copy of the data directory created by the compile operation.
+    The file starts with a magic, a json header describing typed arrays and the arrays themselves which are memory-mapped on load.
+    A dataset is used only while its source file has the recorded size and mtime or, failing that, the recorded sha1.
+    """
+    FileName = "om38to13.bundle"
+    Magic = b"OM3813B1"
+    Version = 2
+    Kinds = {"article": ["label", "a", "b"], "experiment": ["itype", "a", "b"], "empty": ["a"], "alternatives": ["a", "b", "c"]}
+
+    __opened = {}
+
+    def __init__(self, path: str, header, buffer):
+        self.__path = path
+        self.__header = header
+        self.__buffer = buffer
+        self.__indexes = {}
+
+    def path(self) -> str:
+        return self.__path
+
+    def datasets(self):
+        return self.__header["datasets"]
+
+    def index(self, fileName: str):
+        """
+        Returns the IntervalIndex of the given source file or None if it is not bundled or it has changed since compilation.
+        """
+        name = os.path.basename(fileName)
+        if name in self.__indexes:
+            return self.__indexes[name]
+
+        dataset = self.__header["datasets"].get(name)
+        index = None
+        if dataset != None and ReferenceBundle.IsFresh(fileName, dataset["source"]):
+            columns = {}
+            for column, (offset, typecode, length) in dataset["columns"].items():
+                itemsize = array.array(typecode).itemsize
+                columns[column] = self.__buffer[offset:offset + length * itemsize].cast(typecode)
+
+            kind = dataset["kind"]
+            arrays = [PositionArray("q", columns[f + "_chr"], columns[f + "_start"], columns[f + "_end"]) for f in ReferenceBundle.Kinds[kind] if f not in ["label", "itype"]]
+            codes = columns.get("label", columns.get("itype"))
+            rows = PositionRows(kind, arrays, codes, dataset["labels"])
+            chromosomes = {}
+            for chromosome, (offset, count) in dataset["chromosomes"].items():
+                chromosomes[int(chromosome)] = tuple(columns[c][offset:offset + count] for c in ["idx_start", "idx_end", "idx_max_end", "idx_order"])
+            index = IntervalIndex.FromColumns(rows, chromosomes)
+
+        self.__indexes[name] = index
+        return index
+
+    @staticmethod
+    def Fingerprint(fileName: str, withHash: bool = True):
+        stat = os.stat(fileName)
+        result = {"path": os.path.basename(fileName), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        if withHash:
+            with open(fileName, "rb") as f:
+                result["sha1"] = hashlib.sha1(f.read()).hexdigest()
+        return result
+
+    @staticmethod
+    def IsFresh(fileName: str, source) -> bool:
+        if not os.path.exists(fileName):
+            return False
+
+        current = ReferenceBundle.Fingerprint(fileName, False)
+        if current["size"] != source["size"]:
+            return False
+        if current["mtime_ns"] == source["mtime_ns"]:
+            return True
+
+        return ReferenceBundle.Fingerprint(fileName)["sha1"] == source["sha1"]
+
+    @staticmethod
+    def KindOf(fileName: str):
+        name = os.path.basename(fileName)
+        if name.startswith("prediction"):
+            return "article"
+        elif name.startswith("fromHG38toCHM13"):
+            return "experiment"
+        elif name.startswith("fromCHM13toHG38") and name.endswith("-empty"):
+            return "empty"
+        elif name.startswith("fromCHM13toHG38") and name.endswith("-alternatives"):
+            return "alternatives"
+        return None
+
+    @staticmethod
+    def Compile(data_dir: str, bundle_path: str = None) -> str:
+        """
+        Parses every known dataset of the data directory and writes them into a single bundle file.
+        """
+        if bundle_path == None:
+            bundle_path = os.path.join(data_dir, ReferenceBundle.FileName)
+
+        loaders = {"article": OMGenomeTools.LoadArticleData, "experiment": OMGenomeTools.LoadExperimentData,
+                   "empty": OMGenomeTools.LoadEmptyIntervals, "alternatives": OMGenomeTools.LoadAlternativeIntervals}
+
+        datasets = {}
+        blobs = []
+        offset = 0
+
+        def add(typecode, values):
+            nonlocal offset
+            data = array.array(typecode, values).tobytes()
+            padding = (-len(data)) % 8
+            blobs.append(data + b"\0" * padding)
+            entry = [offset, typecode, len(values)]
+            offset += len(data) + padding
+            return entry
+
+        for name in sorted(os.listdir(data_dir)):
+            fileName = os.path.join(data_dir, name)
+            kind = ReferenceBundle.KindOf(name)
+            if kind == None or not os.path.isfile(fileName):
+                continue
+
+            index = loaders[kind](fileName, False)
+            rows = list(index)
+            labels = []
+            columns = {}
+
+            for part, field in enumerate(ReferenceBundle.Kinds[kind]):
+                if field == "label":
+                    labels = sorted(set(r[0] for r in rows))
+                    columns["label"] = add("h", [labels.index(r[0]) for r in rows])
+                    continue
+                if field == "itype":
+                    columns["itype"] = add("b", [r[0].value for r in rows])
+                    continue
+
+                positions = rows if kind == "empty" else [r[part] for r in rows]
+                columns[field + "_chr"] = add("b", [0 if p == None else p.chromosome() for p in positions])
+                columns[field + "_start"] = add("q", [0 if p == None else p.start() for p in positions])
+                columns[field + "_end"] = add("q", [0 if p == None else p.end() for p in positions])
+
+            sorted_columns = [[], [], [], []]
+            chromosomes = {}
+            for chromosome, bucket in sorted(index.chromosomes().items()):
+                chromosomes[str(chromosome)] = [len(sorted_columns[0]), len(bucket[0])]
+                for target, values in zip(sorted_columns, bucket):
+                    target.extend(values)
+
+            for column, typecode, values in zip(["idx_start", "idx_end", "idx_max_end", "idx_order"], "dddq", sorted_columns):
+                columns[column] = add(typecode, values)
+
+            datasets[name] = {"source": ReferenceBundle.Fingerprint(fileName), "kind": kind, "rows": len(rows),
+                              "labels": labels, "columns": columns, "chromosomes": chromosomes}
+
+        header = json.dumps({"version": ReferenceBundle.Version, "byteorder": sys.byteorder, "datasets": datasets}).encode()
+        header += b" " * ((-len(header)) % 8)
+
+        #offsets in the header are relative to the end of the header
+        tmp_path = bundle_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(ReferenceBundle.Magic)
+            f.write(len(header).to_bytes(8, "little"))
+            f.write(header)
+            for blob in blobs:
+                f.write(blob)
+        os.replace(tmp_path, bundle_path)
+
+        ReferenceBundle.__opened.pop(os.path.abspath(bundle_path), None)
+        return bundle_path
+
+    @staticmethod
+    def Open(bundle_path: str):
+        """
+        Memory-maps the bundle, returns None when it does not exist or was written by an incompatible version.
+        Opened bundles are cached until the file changes, missing ones are looked up again on the next call.
+        """
+        key = os.path.abspath(bundle_path)
+        try:
+            stat = os.stat(bundle_path)
+        except OSError:
+            ReferenceBundle.__opened.pop(key, None)
+            return None
+
+        stamp = (stat.st_size, stat.st_mtime_ns)
+        cached = ReferenceBundle.__opened.get(key)
+        if cached != None and cached[0] == stamp:
+            return cached[1]
+
+        bundle = None
+        if stat.st_size > 16:
+            with open(bundle_path, "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+            view = memoryview(mapped)
+            if bytes(view[:8]) == ReferenceBundle.Magic:
+                length = int.from_bytes(view[8:16], "little")
+                header = json.loads(bytes(view[16:16 + length]))
+                if header["version"] == ReferenceBundle.Version and header["byteorder"] == sys.byteorder:
+                    bundle = ReferenceBundle(bundle_path, header, view[16 + length:])
+
+        ReferenceBundle.__opened[key] = (stamp, bundle)
+        return bundle
+
+    @staticmethod
+    def Lookup(fileName: str):
+        """
+        Returns the bundled IntervalIndex for a source data file, None if the text file has to be parsed.
+        """
+        bundle = ReferenceBundle.Open(os.path.join(os.path.dirname(fileName), ReferenceBundle.FileName))
+        if bundle == None:
+            return None
+        return bundle.index(fileName)
+
+class RecordType(enum.Enum):
+        Induced = 1
+        Mapping = 2
+        AlternativeMapping = 3
+        NoMapping = 4
+        NoSource = 5
+        MultipleSources = 6
+
+class AnnotationFormat(enum.Enum):
+        Text = 1
+        TSV = 2
+        JSONL = 3
+
+        @staticmethod
+        def FromName(name: str) -> 'AnnotationFormat':
+            formats = {"text": AnnotationFormat.Text, "tsv": AnnotationFormat.TSV, "jsonl": AnnotationFormat.JSONL}
+            if not isinstance(name, str) or name.lower() not in formats:
+                raise ValueError("unknown annotation format %r, use one of: %s" % (name, ", ".join(formats)))
+            return formats[name.lower()]
+
+        def suffix(self) -> str:
+            return {AnnotationFormat.Text: ".annotated.txt", AnnotationFormat.TSV: ".annotated.tsv", AnnotationFormat.JSONL: ".annotated.jsonl"}[self]
+
+class AnnotationRecord(collections.namedtuple("AnnotationRecord", ["type", "position", "target", "other", "label", "reversed", "dataset"], defaults=[""])):
+    """
+    One event found for a queried interval. Position is the HG38 interval for Induced, Mapping, AlternativeMapping and NoMapping
+    records and the CHM13 interval for NoSource and MultipleSources records, target and other are the mapped intervals.
+    Label is the variant type of Induced records, dataset the name of the mapping dataset of all other records.
+    """
+    __slots__ = ()
+
+    Columns = ["record", "label", "interval", "target", "other", "reversed", "dataset"]
+    Names = {RecordType.Induced: "induced", RecordType.Mapping: "mapping", RecordType.AlternativeMapping: "alternative_mapping",
+             RecordType.NoMapping: "no_mapping", RecordType.NoSource: "no_source", RecordType.MultipleSources: "multiple_sources"}
+
+    def fields(self) -> list:
+        return [AnnotationRecord.Names[self.type], self.label, str(self.position),
+                "" if self.target == None else str(self.target), "" if self.other == None else str(self.other), "1" if self.reversed else "0", self.dataset]
+
+    def toJson(self) -> dict:
+        return {"record": AnnotationRecord.Names[self.type], "label": self.label, "interval": str(self.position),
+                "target": None if self.target == None else str(self.target), "other": None if self.other == None else str(self.other),
+                "reversed": self.reversed, "dataset": self.dataset}
+
+class AnnotationCache:
+    """
+    Memo of the annotation records of queried intervals: an in-process LRU and optionally a SQLite file shared by
+    runs and processes. Disk entries are keyed by the reference fingerprint, dataset and interval (translocation
+    windows already include the distance) and the least recently used ones are evicted above disk_capacity entries.
+    """
+    def __init__(self, fingerprint: str = None, path: str = None, capacity: int = 1 << 16, disk_capacity: int = 1 << 22):
+        self.__fingerprint = fingerprint
+        self.__path = path if fingerprint != None else None
+        self.__capacity = capacity
+        self.__disk_capacity = disk_capacity
+        self.__memo = collections.OrderedDict()
+        self.__lock = threading.Lock()
+        self.__connection = None
+        self.__pid = None
+        self.__pending = []
+        self.__touched = set()
+        self.__hits = 0
+        self.__misses = 0
+
+    def counters(self) -> dict:
+        return {"hits": self.__hits, "misses": self.__misses, "entries": len(self.__memo)}
+
+    def __db(self):
+        #connections are not shared with forked workers
+        if self.__path == None:
+            return None
+        if self.__connection == None or self.__pid != os.getpid():
+            self.__connection = sqlite3.connect(self.__path, timeout=60, check_same_thread=False)
+            self.__connection.execute("PRAGMA journal_mode=WAL")
+            self.__connection.execute("CREATE TABLE IF NOT EXISTS records (key TEXT PRIMARY KEY, value TEXT NOT NULL, used REAL NOT NULL)")
+            self.__connection.execute("CREATE INDEX IF NOT EXISTS records_used ON records (used)")
+            self.__pid = os.getpid()
+            self.__pending = []
+            self.__touched = set()
+        return self.__connection
+
+    @staticmethod
+    def Encode(records) -> str:
+        def position(p):
+            return None if p == None else [p.chromosome(), p.start(), p.end()]
+        return json.dumps([[r.type.value, position(r.position), position(r.target), position(r.other), r.label, r.reversed] for r in records])
+
+    @staticmethod
+    def Decode(value: str) -> list:
+        def position(p):
+            return None if p == None else Position(*p)
+        return [AnnotationRecord(RecordType(t), position(p), position(target), position(other), label, reversed)
+                for t, p, target, other, label, reversed in json.loads(value)]
+
+    def records(self, kind: str, position: 'Position', compute) -> list:
+        """
+        Returns the cached records of the dataset kind for the position, compute() produces them on a miss.
+        """
+        key = (kind, position.chromosome(), position.start(), position.end())
+        with self.__lock:
+            records = self.__memo.get(key)
+            if records != None:
+                self.__memo.move_to_end(key)
+                self.__hits += 1
+                return records
+
+            db = self.__db()
+            disk_key = "%s:%s:%d:%r:%r" % ((self.__fingerprint,) + key)
+            if db != None:
+                row = db.execute("SELECT value FROM records WHERE key = ?", (disk_key,)).fetchone()
+                if row != None:
+                    records = AnnotationCache.Decode(row[0])
+                    self.__touched.add(disk_key)
+
+        if records == None:
+            with RunStats.Stage("overlap queries"):
+                records = list(compute())
+            with self.__lock:
+                self.__misses += 1
+                if self.__path != None:
+                    self.__pending.append((disk_key, AnnotationCache.Encode(records), time.time()))
+                    if len(self.__pending) >= 1024:
+                        self.__flush()
+        else:
+            with self.__lock:
+                self.__hits += 1
+
+        with self.__lock:
+            self.__memo[key] = records
+            if len(self.__memo) > self.__capacity:
+                self.__memo.popitem(last=False)
+        return records
+
+    def __flush(self):
+        db = self.__db()
+        if db == None:
+            return
+
+        now = time.time()
+        with db:
+            db.executemany("INSERT OR REPLACE INTO records (key, value, used) VALUES (?, ?, ?)", self.__pending)
+            db.executemany("UPDATE records SET used = ? WHERE key = ?", [(now, key) for key in self.__touched])
+            count = db.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+            if count > self.__disk_capacity:
+                db.execute("DELETE FROM records WHERE key IN (SELECT key FROM records ORDER BY used LIMIT ?)", (count - self.__disk_capacity,))
+        self.__pending = []
+        self.__touched = set()
+
+    def flush(self):
+        with self.__lock:
+            self.__flush()
+
+class EvidenceSweep:
+    """
+    Decides SV intervals against several evidence tracks at once: the predicted induced variants and the ambiguous
+    (Alternative or Empty) intervals of any number of mapping datasets. Queries are sorted by end once per chromosome
+    and every track is then walked by a single forward merge over its sorted starts, so a track costs a linear pass.
+    overlapMask rejects an interval when any track overlaps it.
+    """
+    def __init__(self, tracks):
+        """
+        Tracks are (name, dataset, keep) with keep None for all intervals or the set of IntervalType values kept.
+        """
+        self.__tracks = list(tracks)
+        self.__buckets = {}
+        self.__lock = threading.Lock()
+
+    @staticmethod
+    def Track(name: str, dataset, keep=None) -> tuple:
+        return (name, dataset, keep)
+
+    def __bucket(self, t: int, chromosome: int):
+        """
+        Sorted starts and running maximum of ends of the kept intervals of track t on the chromosome, None if empty.
+        """
+        key = (t, chromosome)
+        with self.__lock:
+            if key in self.__buckets:
+                return self.__buckets[key]
+
+        _, dataset, keep = self.__tracks[t]
+        index = dataset.partition(chromosome) if isinstance(dataset, PartitionedIndex) else dataset
+        bucket = None if index == None else index.chromosomes().get(chromosome)
+        if bucket != None:
+            starts, ends, max_ends, orders = bucket
+            if keep != None:
+                codes = index.items().codes()
+                kept = [j for j in range(len(orders)) if codes[orders[j]] in keep]
+                starts = array.array("d", [starts[j] for j in kept])
+                max_ends = IntervalIndex.RunningMax(ends[j] for j in kept)
+            bucket = (starts, max_ends) if len(starts) > 0 else None
+
+        with self.__lock:
+            self.__buckets[key] = bucket
+        return bucket
+
+    def masks(self, chromosomes, starts, ends) -> list:
+        """
+        Returns one overlap mask per track for the query intervals given by the columns.
+        """
+        result = [[False] * len(chromosomes) for _ in self.__tracks]
+        by_chromosome = {}
+        for i, chromosome in enumerate(chromosomes):
+            by_chromosome.setdefault(chromosome, []).append(i)
+
+        for chromosome, queries in by_chromosome.items():
+            queries.sort(key=lambda i: ends[i])
+            for t, mask in enumerate(result):
+                bucket = self.__bucket(t, chromosome)
+                if bucket == None:
+                    continue
+
+                #the intervals starting up to the query end only grow as the query ends grow
+                i_starts, max_ends = bucket
+                n = len(i_starts)
+                hi = 0
+                for i in queries:
+                    end = ends[i]
+                    while hi < n and i_starts[hi] <= end:
+                        hi += 1
+                    mask[i] = hi > 0 and max_ends[hi - 1] >= starts[i]
+
+        if RunStats.Active != None:
+            for (name, _, _), mask in zip(self.__tracks, result):
+                RunStats.Active.addOverlaps(name, len(mask), sum(mask))
+        return result
+
+    def overlapMask(self, chromosomes, starts, ends) -> list:
+        masks = self.masks(chromosomes, starts, ends)
+        return [any(overlaps) for overlaps in zip(*masks)] if len(masks) > 0 else [False] * len(chromosomes)
+
+class ReferenceData:
+    """
+    The reference datasets used by view and annotate: HG38 to CHM13 mapping, CHM13 intervals without a source,
+    CHM13 intervals with multiple sources and the predicted induced variants. Further mapping datasets (name, all,
+    empty, alternatives) can be added for annotate and filter, view and liftover use the first one.
+    """
+    #mapping dataset variants of the data directory and their file name suffixes
+    Variants = {"base": "", "alignments": "-alignments", "assemblies": "-assemblies"}
+
+    def __init__(self, all, empty, alternatives, predictions, paths=None, others=None):
+        self.__all = all
+        self.__empty = empty
+        self.__alternatives = alternatives
+        self.__predictions = predictions
+        self.__paths = paths
+        self.__others = others or []
+        self.__cache = AnnotationCache()
+
+    def all(self):
+        return self.__all
+
+    def empty(self):
+        return self.__empty
+
+    def alternatives(self):
+        return self.__alternatives
+
+    def predictions(self):
+        return self.__predictions
+
+    def mappings(self) -> list:
+        """
+        Returns (name, all, empty, alternatives) of every mapping dataset, the first one is all(), empty() and alternatives().
+        """
+        name = self.__all.name() if isinstance(self.__all, PartitionedIndex) else "mapping"
+        return [(name, self.__all, self.__empty, self.__alternatives)] + self.__others
+
+    def evidence(self, mode: 'SMAPFilterType' = None) -> 'EvidenceSweep':
+        """
+        Returns the tracks deciding the filter mode: predicted induced variants, Alternative and Empty intervals
+        of every mapping dataset, or both.
+        """
+        mode = mode or SMAPFilterType.Induced
+        tracks = []
+        if mode != SMAPFilterType.Mapping:
+            name = self.__predictions.name() if isinstance(self.__predictions, PartitionedIndex) else "predictions"
+            tracks.append(EvidenceSweep.Track(name, self.__predictions))
+        if mode != SMAPFilterType.Induced:
+            for name, all, _, _ in self.mappings():
+                tracks.append(EvidenceSweep.Track(name + " ambiguous", all, {IntervalType.Alternative.value, IntervalType.Empty.value}))
+        return EvidenceSweep(tracks)
+
+    def fingerprint(self) -> str:
+        """
+        Hash of the contents of the reference files, None when the data was not loaded from files.
+        """
+        if self.__paths == None:
+            return None
+        digest = hashlib.sha1()
+        for path in self.__paths:
+            digest.update(ReferenceBundle.Fingerprint(path)["sha1"].encode())
+        return digest.hexdigest()
+
+    def cache(self) -> 'AnnotationCache':
+        return self.__cache
+
+    def useCache(self, path: str = None, capacity: int = 1 << 16):
+        """
+        Replaces the in-process memo, with a path the records are also kept in a SQLite file shared across runs.
+        """
+        self.__cache = AnnotationCache(self.fingerprint() if path != None else None, path, capacity)
+
+    def articleRecords(self, position: 'Position') -> list:
+        return self.__cache.records("article", position, lambda: OMGenomeTools.ArticleRecords(position, self.__predictions))
+
+    def experimentRecords(self, position: 'Position') -> list:
+        return self.__cache.records("experiment", position, lambda: OMGenomeTools.ExperimentRecords(position, self.__all, self.__empty, self.__alternatives))
+
+    def otherRecords(self, position: 'Position') -> list:
+        """
+        Returns (name, records) for every further mapping dataset.
+        """
+        return [(name, self.__cache.records("experiment " + name, position, lambda: OMGenomeTools.ExperimentRecords(position, all, empty, alternatives)))
+                for name, all, empty, alternatives in self.__others]
+
+    def preload(self):
+        """
+        Loads every partition of every dataset, e.g. before forking workers which should share them.
+        """
+        for dataset in [self.__all, self.__empty, self.__alternatives, self.__predictions] + [d for other in self.__others for d in other[1:]]:
+            if isinstance(dataset, PartitionedIndex):
+                dataset.preload()
+
+    @staticmethod
+    def Paths(data_dir: str, variants) -> tuple:
+        """
+        Returns the Load arguments for the named variants of the data directory, the first variant is the main dataset.
+        """
+        pairs = [(os.path.join(data_dir, "fromHG38toCHM13" + ReferenceData.Variants[v]), os.path.join(data_dir, "fromCHM13toHG38" + ReferenceData.Variants[v]))
+                 for v in variants]
+        return (pairs[0][0], pairs[0][1], os.path.join(data_dir, "prediction_38.bed"), tuple(pairs[1:]))
+
+    @staticmethod
+    def Load(sample_path_g12, sample_path_g21, predictions_path, others=()) -> 'ReferenceData':
+        """
+        Returns the reference data as lazy PartitionedIndex datasets, nothing is read until the first query.
+        Others are (g12, g21) path pairs of further mapping datasets.
+        """
+        def mapping(g12, g21):
+            return (PartitionedIndex.Get(g12, "experiment"), PartitionedIndex.Get(g21 + "-empty", "empty"),
+                    PartitionedIndex.Get(g21 + "-alternatives", "alternatives"))
+
+        all, empty, alternatives = mapping(sample_path_g12, sample_path_g21)
+        paths = [sample_path_g12, sample_path_g21 + "-empty", sample_path_g21 + "-alternatives", predictions_path]
+        datasets = []
+        for g12, g21 in others:
+            datasets.append((os.path.basename(g12),) + mapping(g12, g21))
+            paths.extend([g12, g21 + "-empty", g21 + "-alternatives"])
+        return ReferenceData(all, empty, alternatives, PartitionedIndex.Get(predictions_path, "article"), paths, datasets)
+
 class OMGenomeTools:    
+    Parsers = {"article": lambda lines, fileName: OMGenomeTools.ParseArticleData(lines, fileName),
+               "experiment": lambda lines, fileName: OMGenomeTools.ParseExperimentData(lines, fileName),
+               "empty": lambda lines, fileName: OMGenomeTools.ParseEmptyIntervals(lines, fileName),
+               "alternatives": lambda lines, fileName: OMGenomeTools.ParseAlternativeIntervals(lines, fileName)}
+
     @staticmethod
-    def Filter(smap_path, options, sample_path_g12, sample_path_g21, predictions_path, result_path, epsilon=10000):
+    def Filter(smap_path, options, sample_path_g12, sample_path_g21, predictions_path, result_path, epsilon=10000, others=()):
         """
-        Three options - mapping, induced, both
+        Three options - mapping, induced, both (SMAPFilterType, None is induced)
+        Use "-" as smap_path or result_path to read from stdin or write to stdout.
         """
-        smap = SMAP.FromFile(smap_path, epsilon)
-        smap_ids = []
-        data_from_genome = OMGenomeTools.LoadArticleData(predictions_path)
+        if smap_path != "-" and not os.path.exists(smap_path):
+            ExitWithPrint("The specified smap input file does not exists.")
+        if IsSamePath(smap_path, result_path):
+            #the input is streamed, opening the output would truncate it
+            ExitWithPrint("The output path must differ from the input smap file.")
 
-        for item in smap.common():
-            if OMGenomeTools.ProcessArticleData("", item[1], data_from_genome) == "":
-                smap_ids.append(item[0])
+        evidence = ReferenceData.Load(sample_path_g12, sample_path_g21, predictions_path, others).evidence(options)
 
-        for item in smap.translocations():            
-            if OMGenomeTools.ProcessArticleData("", item[1], data_from_genome) == "" and OMGenomeTools.ProcessArticleData("", item[2], data_from_genome) == "":
-                smap_ids.append(item[0])
+        instream = sys.stdin if smap_path == "-" else OpenText(smap_path)
+        outstream = sys.stdout if result_path == "-" else OpenText(result_path, "w")
+        try:
+            with RunStats.Stage("filter"):
+                return OMGenomeTools.FilterStream(instream, outstream, evidence, epsilon)
+        finally:
+            if instream is not sys.stdin: instream.close()
+            if outstream is not sys.stdout: outstream.close()
 
-        for item in smap.inversions():
-            if OMGenomeTools.ProcessArticleData("", item[2], data_from_genome) == "":
-                smap_ids.append(item[0])
-        
-        smap_ids.sort()
-        smap.serialize(result_path, smap_ids)
+    FilterBlock = 1 << 14
+
+    @staticmethod
+    def FilterStream(instream, outstream, data_from_genome, epsilon=10000):
+        """
+        Copies the rows of instream which do not overlap the EvidenceSweep data_from_genome to outstream
+        in their original order. Rows are decided in blocks of FilterBlock variants by one overlapMask sweep, only the
+        rows of the current block and rows behind a partial inversion still waiting for its linked row are held in memory.
+        Returns the number of rows, kept rows and common, translocation and inversion variants.
+        """
+        counts = {"rows": 0, "kept": 0, "common": 0, "translocations": 0, "inversions": 0}
+
+        #slots [line or None, resolved] in input order, written once everything before them is resolved
+        queue = collections.deque()
+        waiting = {}
+        partial_by_id = {}
+        paired = set()
+        pending = []
+
+        def push(line, resolved):
+            if len(queue) == 0 and resolved:
+                if line != None: outstream.write(line + "\n")
+                return None
+
+            slot = [line, resolved]
+            queue.append(slot)
+            return slot
+
+        def flush():
+            while len(queue) > 0 and queue[0][1]:
+                line = queue.popleft()[0]
+                if line != None: outstream.write(line + "\n")
+
+        def decide():
+            owners = array.array("q")
+            chromosomes = array.array("q")
+            starts = array.array("d")
+            ends = array.array("d")
+            for owner, (_, positions) in enumerate(pending):
+                for position in positions:
+                    owners.append(owner)
+                    chromosomes.append(position.chromosome())
+                    starts.append(position.start())
+                    ends.append(position.end())
+
+            induced = [False] * len(pending)
+            for owner, overlaps in zip(owners, data_from_genome.overlapMask(chromosomes, starts, ends)):
+                if overlaps: induced[owner] = True
+
+            for (slot, _), is_induced in zip(pending, induced):
+                if is_induced:
+                    slot[0] = None
+                else:
+                    counts["kept"] += 1
+                slot[1] = True
+            pending.clear()
+            flush()
+
+        def resolve(slot, item, itemB):
+            inversion = SMAP.PairInversion(item, itemB)
+            paired.add(item[0])
+            paired.add(itemB[0])
+            counts["inversions"] += 1
+            pending.append((slot, [inversion[2]]))
+
+        for rtype, line, item in SMAP.ReadRows(instream, epsilon):
+            if rtype == SMAPRowType.Header:
+                push(line, True)
+                continue
+
+            counts["rows"] += 1
+            if rtype == SMAPRowType.Common:
+                counts["common"] += 1
+                pending.append((push(line, False), [item[1]]))
+            elif rtype == SMAPRowType.Translocation:
+                counts["translocations"] += 1
+                pending.append((push(line, False), [item[1], item[2]]))
+            else:
+                slot = push(line, False)
+                partial_by_id.setdefault(item[0], item)
+
+                for w_slot, w_item in waiting.pop(item[0], []):
+                    resolve(w_slot, w_item, item)
+
+                #as in SMAP.FromFile only the first row of a linked pair is kept
+                if item[0] in paired:
+                    slot[0] = None
+                    slot[1] = True
+                elif item[1] in partial_by_id:
+                    resolve(slot, item, partial_by_id[item[1]])
+                else:
+                    waiting.setdefault(item[1], []).append((slot, item))
+
+            if len(pending) >= OMGenomeTools.FilterBlock:
+                decide()
+
+        decide()
+        for link_id, items in waiting.items():
+            ExitWithPrint("Inversion: linked entry %d of %d not found." % (link_id, items[0][1][0]))
+
+        flush()
+        if RunStats.Active != None: RunStats.Active.addVariants(counts["common"], counts["translocations"], counts["inversions"])
+        return counts
 
     @staticmethod
     def View(interval, sample_path_g12, sample_path_g21, predictions_path):
         position = Position.FromString(interval)
-        all = OMGenomeTools.LoadExperimentData(sample_path_g12)
-        empty = OMGenomeTools.LoadEmptyIntervals(sample_path_g21 + "-empty")
-        alternatives = OMGenomeTools.LoadAlternativeIntervals(sample_path_g21 + "-alternatives")
-        data_from_genome = OMGenomeTools.LoadArticleData(predictions_path)
-
-        print("Position: ", str(position))
-        print("\tStructural variants induced by transition from HG38 to CHM13-T2T")
-        print("\t\tType|HG38 coordinate (size)|CHM13 coordinate (size)")
-        sv_data = OMGenomeTools.ProcessArticleData("\t\t", position, data_from_genome)
+        reference = ReferenceData.Load(sample_path_g12, sample_path_g21, predictions_path)
+        with RunStats.Stage("view"):
+            OMGenomeTools.WriteView(sys.stdout, position, reference)
+
+    @staticmethod
+    def WriteView(ostream, position, reference):
+        ostream.write("Position:  " + str(position) + "\n")
+        ostream.write("\tStructural variants induced by transition from HG38 to CHM13-T2T\n")
+        ostream.write("\t\tType|HG38 coordinate (size)|CHM13 coordinate (size)\n")
+        sv_data = OMGenomeTools.ProcessArticleData("\t\t", position, reference.predictions())
         if sv_data == "":
-            print("\t\tNone")
+            ostream.write("\t\tNone\n")
         else:
-            print(sv_data)
+            ostream.write(sv_data + "\n")
+
+        ostream.write("\tAmbigous and other mapping events\n")
+        ostream.write(OMGenomeTools.ProcessExperimentData("\t\t", position, reference.all(), reference.empty(), reference.alternatives()) + "\n")
+        ostream.write("\n\n")
 
-        print("\tAmbigous and other mapping events")
-        print(OMGenomeTools.ProcessExperimentData("\t\t", position, all, empty, alternatives))
-        print("\n")
+    WriteBuffer = 1 << 20
 
     @staticmethod
-    def Annotate(smap_path, sample_path_g12, sample_path_g21, predictions_path, result_path, epsilon=10000):
+    def Annotate(smap_path, sample_path_g12, sample_path_g21, predictions_path, result_path, epsilon=10000, jobs=1, fmt=AnnotationFormat.Text, cache_path=None, others=()):
+        if IsSamePath(smap_path, result_path):
+            ExitWithPrint("The output path must differ from the input smap file.")
         smap = SMAP.FromFile(smap_path, epsilon)
+        reference = ReferenceData.Load(sample_path_g12, sample_path_g21, predictions_path, others)
+        if cache_path != None:
+            reference.useCache(cache_path)
 
-        data_from_experiments = []
-        all = OMGenomeTools.LoadExperimentData(sample_path_g12)
-        empty = OMGenomeTools.LoadEmptyIntervals(sample_path_g21 + "-empty")
-        alternatives = OMGenomeTools.LoadAlternativeIntervals(sample_path_g21 + "-alternatives")
+        with OpenText(result_path, "w") as ostream, RunStats.Stage("annotate"):
+            OMGenomeTools.WriteAnnotation(ostream, smap, reference, epsilon, jobs, fmt)
 
-        data_from_experiments.append((all, empty, alternatives))
-        data_from_genome = OMGenomeTools.LoadArticleData(predictions_path)
+    @staticmethod
+    def AnnotationUnits(smap) -> list:
+        """
+        Lists the variants of the smap as (SMAPRowType, item) in the order of the annotation output: common variants,
+        translocations and inversions.
+        """
+        return [(SMAPRowType.Common, item) for item in smap.common()] + \
+               [(SMAPRowType.Translocation, item) for item in smap.translocations()] + \
+               [(SMAPRowType.InversionPartial, item) for item in smap.inversions()]
+
+    @staticmethod
+    def UnitQueries(unit) -> list:
+        """
+        Returns the (breakpoint, Position) intervals annotated for a variant, A and B windows for translocations.
+        """
+        rtype, item = unit
+        if rtype == SMAPRowType.Common:
+            return [("", item[1])]
+        elif rtype == SMAPRowType.Translocation:
+            return [("A", item[1]), ("B", item[2])]
+        return [("", item[2])]
 
-        def Process(fstream, indentation, position, d_from_article, d_all, d_empty, d_alternatives):
+    @staticmethod
+    def AnnotationRecords(unit, reference):
+        """
+        Yields (breakpoint, queried Position, AnnotationRecord or None) for a variant, None marks a queried interval without any event.
+        The mapping records carry the name of their dataset.
+        """
+        primary = reference.mappings()[0][0]
+        for breakpoint, position in OMGenomeTools.UnitQueries(unit):
+            found = False
+            others = [r._replace(dataset=name) for name, records in reference.otherRecords(position) for r in records]
+            mapping = [r._replace(dataset=primary) for r in reference.experimentRecords(position)]
+            for record in itertools.chain(reference.articleRecords(position), mapping, others):
+                found = True
+                yield (breakpoint, position, record)
+            if not found:
+                yield (breakpoint, position, None)
+
+    AnnotationColumns = ["id", "link_id", "category", "type", "breakpoint", "query"] + AnnotationRecord.Columns
+
+    @staticmethod
+    def UnitFields(unit, smap) -> list:
+        rtype, item = unit
+        category = {SMAPRowType.Common: "common", SMAPRowType.Translocation: "translocation", SMAPRowType.InversionPartial: "inversion"}[rtype]
+        link_id = str(item[1]) if rtype == SMAPRowType.InversionPartial else ""
+        return [str(item[0]), link_id, category, smap.original()[item[0]].split("\t")[9]]
+
+    @staticmethod
+    def WriteAnnotationUnit(ostream, unit, smap, reference, epsilon=10000, fmt=AnnotationFormat.Text):
+        if fmt == AnnotationFormat.TSV:
+            prefix = "\t".join(OMGenomeTools.UnitFields(unit, smap)) + "\t"
+            empty = "none" + "\t" * (len(AnnotationRecord.Columns) - 1)
+            ostream.write("".join(prefix + breakpoint + "\t" + str(position) + "\t" + ("\t".join(record.fields()) if record != None else empty) + "\n"
+                                  for breakpoint, position, record in OMGenomeTools.AnnotationRecords(unit, reference)))
+            return
+        elif fmt == AnnotationFormat.JSONL:
+            id, link_id, category, sv_type = OMGenomeTools.UnitFields(unit, smap)
+            queries = {}
+            for breakpoint, position, record in OMGenomeTools.AnnotationRecords(unit, reference):
+                query = queries.setdefault(breakpoint, {"breakpoint": breakpoint, "interval": str(position), "events": []})
+                if record != None:
+                    query["events"].append(record.toJson())
+            ostream.write(json.dumps({"id": int(id), "link_id": int(link_id) if link_id != "" else None, "category": category,
+                                      "type": sv_type, "queries": list(queries.values())}) + "\n")
+            return
+
+        primary = reference.mappings()[0][0]
+
+        def Process(fstream, indentation, position):
             fstream.write("\tStructural variants induced by transition from HG38 to CHM13-T2T\n")
-            sv_data = OMGenomeTools.ProcessArticleData(indentation + "\t\t", position, d_from_article)
+            sv_data = "".join(OMGenomeTools.FormatRecord(indentation + "\t\t", r) for r in reference.articleRecords(position))
             if sv_data == "":
                 fstream.write("\t\tNone\n")
             else:
                 fstream.write(sv_data)
 
-            fstream.write("\tAmbigous and other mapping events\n")
-            fstream.write(OMGenomeTools.ProcessExperimentData(indentation + "\t\t", position, d_all, d_empty, d_alternatives))
+            others = reference.otherRecords(position)
+            if len(others) == 0:
+                fstream.write("\tAmbigous and other mapping events\n")
+            else:
+                fstream.write("\tAmbigous and other mapping events (" + primary + ")\n")
+            fstream.write("".join(OMGenomeTools.FormatRecord(indentation + "\t\t", r) for r in reference.experimentRecords(position)))
+            for name, records in others:
+                fstream.write("\tAmbigous and other mapping events (" + name + ")\n")
+                fstream.write("".join(OMGenomeTools.FormatRecord(indentation + "\t\t", r) for r in records))
             fstream.write("\n")
 
-        ostream = open(result_path, "w")
-        orig = smap.original()
-        for item in smap.common():
-            ostream.write(str(item[0]) + " " + str(item[1]) + " " + orig[item[0]] + "\n")
-            Process(ostream, "", item[1], data_from_genome, data_from_experiments[0][0], data_from_experiments[0][1], data_from_experiments[0][2])
-
-        for item in smap.translocations():
+        rtype, item = unit
+        if rtype == SMAPRowType.Common:
+            ostream.write(str(item[0]) + " " + str(item[1]) + " " + smap.original()[item[0]] + "\n")
+            Process(ostream, "", item[1])
+        elif rtype == SMAPRowType.Translocation:
             ostream.write(str(item[0]) + " TRANSLOCATION A=" + item[1].tString(epsilon) + "\t" + item[2].tString(epsilon) + "\n")
             ostream.write("\tA: " + str(item[1]))
-            Process(ostream, "\t", item[1], data_from_genome, data_from_experiments[0][0], data_from_experiments[0][1], data_from_experiments[0][2])
+            Process(ostream, "\t", item[1])
             ostream.write("\tB: " + str(item[2]))
-            Process(ostream, "\t", item[2], data_from_genome, data_from_experiments[0][0], data_from_experiments[0][1], data_from_experiments[0][2])
+            Process(ostream, "\t", item[2])
             ostream.write("\n")
-
-        for item in smap.inversions():
+        else:
             ostream.write(str(item[0]) + " " + str(item[1]) + " INVERSION " + str(item[2]) + "\n")
-            Process(ostream, "", item[2], data_from_genome, data_from_experiments[0][0], data_from_experiments[0][1], data_from_experiments[0][2])
+            Process(ostream, "", item[2])
+
+    @staticmethod
+    def WriteAnnotation(ostream, smap, reference, epsilon=10000, jobs=1, fmt=AnnotationFormat.Text):
+        if fmt == AnnotationFormat.TSV:
+            ostream.write("#" + "\t".join(OMGenomeTools.AnnotationColumns) + "\n")
+
+        units = OMGenomeTools.AnnotationUnits(smap)
+        if jobs > 1 and len(units) > 1 and "fork" in multiprocessing.get_all_start_methods():
+            ShardedAnnotation.Write(ostream, units, smap, reference, epsilon, jobs, fmt)
+            return
 
-        ostream.close()
+        for unit in units:
+            OMGenomeTools.WriteAnnotationUnit(ostream, unit, smap, reference, epsilon, fmt)
+        reference.cache().flush()
 
     @staticmethod
-    def LoadArticleData(fileName: str):
-        result = []
+    def LoadArticleData(fileName: str, useBundle: bool = True):
+        if useBundle:
+            bundled = ReferenceBundle.Lookup(fileName)
+            if bundled != None:
+                return bundled
+
         with open(fileName) as f:
-            for line in f.readlines():
-                ls = line.strip()
-                if len(ls) == 0:
-                    continue
+            return OMGenomeTools.ParseArticleData(f, fileName)
 
-                values = ls.replace(";","\t").split("\t")
-                if(len(values) != 3): ExitWithPrint("Unexpected data format of: %s" % fileName)
+    @staticmethod
+    def ParseArticleData(lines, fileName: str):
+        hg38 = PositionArray()
+        chm13 = PositionArray()
+        codes = array.array("h")
+        labels = {}
 
-                result.append((values[0], Position.FromString(values[1]), Position.FromString(values[2])))
+        for line in lines:
+            ls = line.strip()
+            if len(ls) == 0:
+                continue
 
-        return result
+            values = ls.replace(";","\t").split("\t")
+            if(len(values) != 3): ExitWithPrint("Unexpected data format of: %s" % fileName)
+
+            codes.append(labels.setdefault(values[0], len(labels)))
+            hg38.append(*Position.ParseString(values[1]))
+            chm13.append(*Position.ParseString(values[2]))
+
+        return IntervalIndex(PositionRows("article", [hg38, chm13], codes, list(labels)), None, hg38)
 
     @staticmethod
-    def LoadExperimentData(fileName: str):
-        result = []
+    def LoadExperimentData(fileName: str, useBundle: bool = True):
+        if useBundle:
+            bundled = ReferenceBundle.Lookup(fileName)
+            if bundled != None:
+                return bundled
 
         with open(fileName) as f:
-            for line in f.readlines():
-                ls = line.strip()
-                if len(ls) == 0:
-                    continue
+            return OMGenomeTools.ParseExperimentData(f, fileName)
 
-                values = ls.replace(";","\t").split("\t")
-                if len(values) == 2 and values[0].startswith("E"):
-                    result.append((IntervalType.Empty, Position.FromString(values[1]), None))
-                elif len(values) == 3:
-                    itype = IntervalType.Simple if values[0].startswith("S") else IntervalType.Alternative
-                    result.append((itype, Position.FromString(values[1]), Position.FromString(values[2])))
-                else:
-                    ExitWithPrint("Unexpected input data for %s" % fileName)
+    @staticmethod
+    def ParseExperimentData(lines, fileName: str):
+        hg38 = PositionArray()
+        chm13 = PositionArray()
+        codes = array.array("b")
+
+        for line in lines:
+            ls = line.strip()
+            if len(ls) == 0:
+                continue
+
+            values = ls.replace(";","\t").split("\t")
+            if len(values) == 2 and values[0].startswith("E"):
+                codes.append(IntervalType.Empty.value)
+                hg38.append(*Position.ParseString(values[1]))
+                chm13.append(0, 0, 0)
+            elif len(values) == 3:
+                itype = IntervalType.Simple if values[0].startswith("S") else IntervalType.Alternative
+                codes.append(itype.value)
+                hg38.append(*Position.ParseString(values[1]))
+                chm13.append(*Position.ParseString(values[2]))
+            else:
+                ExitWithPrint("Unexpected input data for %s" % fileName)
 
-        return result
+        return IntervalIndex(PositionRows("experiment", [hg38, chm13], codes), None, hg38)
 
     @staticmethod
-    def LoadEmptyIntervals(fileName: str):
-        result = []
+    def LoadEmptyIntervals(fileName: str, useBundle: bool = True):
+        if useBundle:
+            bundled = ReferenceBundle.Lookup(fileName)
+            if bundled != None:
+                return bundled
 
         with open(fileName) as f:
-            for line in f.readlines():
-                ls = line.strip()
-                if len(ls) == 0:
-                    continue
+            return OMGenomeTools.ParseEmptyIntervals(f, fileName)
 
-                result.append(Position.FromString(ls))
+    @staticmethod
+    def ParseEmptyIntervals(lines, fileName: str):
+        chm13 = PositionArray()
+
+        for line in lines:
+            ls = line.strip()
+            if len(ls) == 0:
+                continue
+
+            chm13.append(*Position.ParseString(ls))
         
-        return result
+        return IntervalIndex(PositionRows("empty", [chm13]), None, chm13)
 
     @staticmethod
-    def LoadAlternativeIntervals(fileName: str):
-        result = []
+    def LoadAlternativeIntervals(fileName: str, useBundle: bool = True):
+        if useBundle:
+            bundled = ReferenceBundle.Lookup(fileName)
+            if bundled != None:
+                return bundled
 
         with open(fileName) as f:
-            for line in f.readlines():
-                ls = line.strip()
-                if len(ls) == 0:
-                    continue
-                
-                values = ls.split("\t")
-                result.append((Position.FromString(values[0]), Position.FromString(values[1]), Position.FromString(values[2])))
-
-        return result
+            return OMGenomeTools.ParseAlternativeIntervals(f, fileName)
 
     @staticmethod
-    def ProcessArticleData(indentation: str, position: 'Position', dataFromArticle) -> str:
-        result = ""
+    def ParseAlternativeIntervals(lines, fileName: str):
+        columns = [PositionArray(), PositionArray(), PositionArray()]
 
-        for item in dataFromArticle:
-            if item[1].overlapWith(position):
-                result += indentation + item[0] + " " + str(item[1]) + " (" + str(item[1].diff()) + ") " + str(item[2]) + " (" + str(item[2].diff()) + ")" + "\n"
+        for line in lines:
+            ls = line.strip()
+            if len(ls) == 0:
+                continue
+            
+            values = ls.split("\t")
+            if len(values) < 3: ExitWithPrint("Unexpected input data for %s" % fileName)
+            for column, value in zip(columns, values[:3]):
+                column.append(*Position.ParseString(value))
 
-        return result
+        return IntervalIndex(PositionRows("alternatives", columns), None, columns[0])
 
     @staticmethod
-    def ProcessExperimentData(indentation: str, position: 'Position', all, empty, alternatives) -> str:
-        result = ""
-        atLeastOne = False
-
-        all_overlaped = list(filter(lambda x: x[1].overlapWith(position), all))
+    def ArticleRecords(position: 'Position', dataFromArticle, hits=None):
+        """
+        Yields an AnnotationRecord for every predicted induced variant overlapping the position.
+        Already queried hits of dataFromArticle can be passed to skip the lookup.
+        """
+        for item in (dataFromArticle.overlapping(position) if hits == None else hits):
+            yield AnnotationRecord(RecordType.Induced, item[1], item[2], None, item[0], False)
 
-        for itype, ihg, ichm in all_overlaped:
+    @staticmethod
+    def ExperimentRecords(position: 'Position', all, empty, alternatives, hits=None):
+        """
+        Yields AnnotationRecords of the mapping of the position to CHM13, each Mapping or AlternativeMapping record
+        is followed by NoSource and MultipleSources records of its target.
+        """
+        for itype, ihg, ichm in (all.overlapping(position) if hits == None else hits):
             intersection = position.intersectionWith(ihg)
             if itype == IntervalType.Simple or itype == IntervalType.Alternative:
                 target = ichm.getMapping(ihg, intersection)      
-                message = 2 if itype == IntervalType.Simple else 3
-                
-                msg_end = messages[0] if ichm != None and ichm.isReversed() else ""
-                result += indentation + str(intersection) + " " + messages[message] + " " + str(target) + msg_end + "\n"
+                rtype = RecordType.Mapping if itype == IntervalType.Simple else RecordType.AlternativeMapping
+                yield AnnotationRecord(rtype, intersection, target, None, "", ichm != None and ichm.isReversed())
 
                 if target != None:
                     if target.start() > target.end():
                         target = Position(target.chromosome(), target.end(), target.start())
-                    empty_overlaped = list(filter(lambda x: x.overlapWith(target), empty))
-                    for emptyival in empty_overlaped:
-                        result += indentation + "\t" + str(emptyival.intersectionWith(target)) + " " + messages[4] + "\n"
-                    alternative_overlaped = list(filter(lambda x: x[0].overlapWith(target), alternatives))
-                    for alt_ival in alternative_overlaped:                                             
+                    for emptyival in empty.overlapping(target):
+                        yield AnnotationRecord(RecordType.NoSource, emptyival.intersectionWith(target), None, None, "", False)
+                    for alt_ival in alternatives.overlapping(target):
                         part = alt_ival[0].intersectionWith(target)
-                        result += indentation + "\t" + str(part) + " " + messages[5] + " " + str(alt_ival[1].getMapping(alt_ival[0], part)) + " " + str(alt_ival[2].getMapping(alt_ival[0], part)) + "\n"
+                        yield AnnotationRecord(RecordType.MultipleSources, part, alt_ival[1].getMapping(alt_ival[0], part), alt_ival[2].getMapping(alt_ival[0], part), "", False)
             elif itype == IntervalType.Empty:
-                result += indentation + str(intersection) + " " + messages[1] + "\n"
+                yield AnnotationRecord(RecordType.NoMapping, intersection, None, None, "", False)
 
-            atLeastOne = True
+    @staticmethod
+    def FormatRecord(indentation: str, record: 'AnnotationRecord') -> str:
+        rtype = record.type
+        if rtype == RecordType.Induced:
+            return indentation + record.label + " " + str(record.position) + " (" + str(record.position.diff()) + ") " + str(record.target) + " (" + str(record.target.diff()) + ")" + "\n"
+        elif rtype == RecordType.Mapping or rtype == RecordType.AlternativeMapping:
+            message = 2 if rtype == RecordType.Mapping else 3
+            msg_end = messages[0] if record.reversed else ""
+            return indentation + str(record.position) + " " + messages[message] + " " + str(record.target) + msg_end + "\n"
+        elif rtype == RecordType.NoSource:
+            return indentation + "\t" + str(record.position) + " " + messages[4] + "\n"
+        elif rtype == RecordType.MultipleSources:
+            return indentation + "\t" + str(record.position) + " " + messages[5] + " " + str(record.target) + " " + str(record.other) + "\n"
+        else:
+            return indentation + str(record.position) + " " + messages[1] + "\n"
 
+    @staticmethod
+    def ProcessArticleData(indentation: str, position: 'Position', dataFromArticle) -> str:
+        return "".join(OMGenomeTools.FormatRecord(indentation, r) for r in OMGenomeTools.ArticleRecords(position, dataFromArticle))
+
+    @staticmethod
+    def ProcessExperimentData(indentation: str, position: 'Position', all, empty, alternatives) -> str:
+        return "".join(OMGenomeTools.FormatRecord(indentation, r) for r in OMGenomeTools.ExperimentRecords(position, all, empty, alternatives))
+
+    @staticmethod
+    def ReadRegions(stream):
+        """
+        Reads (name, Position) pairs from BED lines (0-based, half-open) or from chr:start-end lines.
+        Regions on contigs without a Bionano number (chrM, alt and random contigs) are skipped and reported on stderr.
+        """
+        skipped = []
+        for lineno, line in enumerate(stream, 1):
+            l = line.strip()
+            if len(l) == 0 or l.startswith("#") or l.startswith("track") or l.startswith("browser"):
+                continue
+
+            values = l.split("\t")
+            try:
+                chromosome = Position.ChrToBionano(values[0] if len(values) >= 3 else l.split(":", 1)[0])
+            except ValueError:
+                skipped.append(lineno)
+                continue
+
+            if len(values) >= 3:
+                try:
+                    start = int(values[1]) + 1
+                    end = int(values[2])
+                except ValueError:
+                    ExitWithPrint("Invalid BED region at line %d: %s" % (lineno, l))
+                position = Position(chromosome, start, end if end >= start else start)
+                yield (values[3] if len(values) > 3 else str(position), position)
+            else:
+                yield (l, Position.FromString(l))
+
+        if len(skipped) > 0:
+            sys.stderr.write("Skipped %d regions on unsupported contigs at lines %s%s\n" % (len(skipped), ", ".join(map(str, skipped[:10])), ", ..." if len(skipped) > 10 else ""))
+
+    @staticmethod
+    def ViewBatch(regions, reference, ostream, batch: int = 100000):
+        """
+        Writes TSV records of all regions, one line per overlapping event and a "none" line for regions without any.
+        Regions are read in chunks of batch, each queried per chromosome in one sorted sweep over the prediction and mapping indexes.
+        """
+        ostream.write("#" + "\t".join(["region", "name"] + AnnotationRecord.Columns) + "\n")
+        regions = iter(regions)
+        while True:
+            chunk = list(itertools.islice(regions, batch))
+            if len(chunk) == 0:
+                break
+
+            positions = [r[1] for r in chunk]
+            predicted = reference.predictions().overlappingMany(positions)
+            mapped = reference.all().overlappingMany(positions)
+            dataset = reference.mappings()[0][0]
+            for (name, position), p_hits, m_hits in zip(chunk, predicted, mapped):
+                prefix = str(position) + "\t" + name + "\t"
+                written = False
+                records = itertools.chain(OMGenomeTools.ArticleRecords(position, None, p_hits),
+                                          (r._replace(dataset=dataset) for r in OMGenomeTools.ExperimentRecords(position, None, reference.empty(), reference.alternatives(), m_hits)))
+                for record in records:
+                    ostream.write(prefix + "\t".join(record.fields()) + "\n")
+                    written = True
+                if not written:
+                    ostream.write(prefix + "none" + "\t" * (len(AnnotationRecord.Columns) - 1) + "\n")
+
+class LiftoverResult(collections.namedtuple("LiftoverResult", ["position", "mapped", "mappings", "flags"])):
+    """
+    Result of lifting one interval: the primary mapped Position (start <= end, None when unmapped), all candidate
+    (Position, reversed) mappings and the flags unmapped, partial, reversed, multi_mapping and multi_source.
+    """
+    __slots__ = ()
+
+    Columns = ["name", "input", "mapped", "strand", "flags", "mappings"]
+
+    def fields(self, name: str) -> list:
+        reversed = "reversed" in self.flags
+        return [name, str(self.position), "" if self.mapped == None else str(self.mapped), "" if self.mapped == None else ("-" if reversed else "+"),
+                ",".join(self.flags), ",".join(str(m) + ("(-)" if r else "") for m, r in self.mappings)]
+
+class Liftover:
+    """
+    Translates intervals between HG38 and CHM13 with the piecewise proportional mapping of the Simple and Alternative
+    segments of fromHG38toCHM13-*. The CHM13 to HG38 direction uses the same segments indexed by their CHM13 side,
+    the CHM13 intervals without or with multiple HG38 sources come from the fromCHM13toHG38-*-empty and -alternatives tables.
+    """
+    def __init__(self, reference: 'ReferenceData', reverse: bool = False):
+        self.__reverse = reverse
+        self.__reference = reference
+
+        if reverse:
+            #segments keyed by CHM13 with the HG38 side oriented so that getMapping interpolates in the right direction
+            segments = []
+            for itype, ihg, ichm in reference.all():
+                if ichm == None:
+                    continue
+                if ichm.isReversed():
+                    segments.append((itype, Position(ichm.chromosome(), ichm.end(), ichm.start()), Position(ihg.chromosome(), ihg.end(), ihg.start())))
+                else:
+                    segments.append((itype, ichm, ihg))
+            self.__segments = IntervalIndex(segments, lambda x: x[1])
+        else:
+            self.__segments = reference.all()
+
+    def lift(self, positions) -> list:
+        """
+        Lifts all positions in one batched query of the segment index, results follow the order of positions.
+        """
+        positions = list(positions)
+        return [self.__liftOne(position, hits) for position, hits in zip(positions, self.__segments.overlappingMany(positions))]
+
+    def __liftOne(self, position: 'Position', hits) -> 'LiftoverResult':
+        flags = []
+        candidates = []
+        spans = []
+        for itype, whole, target in hits:
+            intersection = position.intersectionWith(whole)
+            if itype == IntervalType.Empty or target == None:
+                flags.append("partial")
+                continue
+
+            mapped = target.getMapping(whole, intersection)
+            reversed = mapped.isReversed() or target.isReversed()
+            if mapped.isReversed():
+                mapped = Position(mapped.chromosome(), mapped.end(), mapped.start())
+            candidates.append((itype != IntervalType.Simple, -intersection.diff(), len(candidates), mapped, reversed))
+            spans.append((intersection.start(), intersection.end()))
+
+        if len(candidates) == 0:
+            return LiftoverResult(position, None, [], ["unmapped"])
+
+        #overlapping segments are merged so the covered length is not counted twice
+        covered = 0
+        span_start, span_end = None, None
+        for start, end in sorted(spans):
+            if span_end != None and start <= span_end:
+                span_end = max(span_end, end)
+                continue
+            if span_end != None:
+                covered += span_end - span_start + 1
+            span_start, span_end = start, end
+        covered += span_end - span_start + 1
+        if covered < position.diff():
+            flags.append("partial")
+
+        candidates.sort()
+        mapped, reversed = candidates[0][3], candidates[0][4]
+        if reversed:
+            flags.append("reversed")
+        if len(candidates) > 1:
+            flags.append("multi_mapping")
+
+        #CHM13 intervals with several HG38 sources, checked on the CHM13 side of the mapping
+        chm13 = position if self.__reverse else mapped
+        if self.__reference.alternatives().overlapsAny(chm13):
+            flags.append("multi_source")
+        if self.__reverse and self.__reference.empty().overlapsAny(chm13) and "partial" not in flags:
+            flags.append("partial")
+
+        return LiftoverResult(position, mapped, [(c[3], c[4]) for c in sorted(candidates, key=lambda c: c[2])], sorted(set(flags), key=flags.index))
+
+    @staticmethod
+    def ReadPositions(stream, smap: bool = False):
+        """
+        Reads (name, Position) pairs from BED or region lines, or from SMAP rows where translocations contribute both
+        breakpoints and partial inversions their breakpoint interval.
+        """
+        if not smap:
+            yield from OMGenomeTools.ReadRegions(stream)
+            return
+
+        for rtype, line, item in SMAP.ReadRows(stream, 0):
+            if rtype == SMAPRowType.Header:
+                continue
+            elif rtype == SMAPRowType.Common:
+                yield (str(item[0]), item[1])
+            elif rtype == SMAPRowType.Translocation:
+                yield (str(item[0]) + ":A", item[1])
+                yield (str(item[0]) + ":B", item[2])
+            else:
+                id, _, chromosome, x, y = item
+                yield (str(id), Position(chromosome, x, x if y == -1 else y))
+
+    def write(self, named_positions, ostream, batch: int = 100000):
+        ostream.write("#" + "\t".join(LiftoverResult.Columns) + "\n")
+        named_positions = iter(named_positions)
+        while True:
+            chunk = list(itertools.islice(named_positions, batch))
+            if len(chunk) == 0:
+                break
+            for (name, _), result in zip(chunk, self.lift(p for _, p in chunk)):
+                ostream.write("\t".join(result.fields(name)) + "\n")
+
+class ShardedAnnotation:
+    """
+    Annotates the variants of one smap on several forked processes. Variants are ordered by chromosome and cut into
+    shards of equal size, so every worker touches only the index slices of a few chromosomes. The annotated blocks
+    are merged back into the serial order.
+    """
+    __state = None
+
+    @staticmethod
+    def Chromosome(unit) -> int:
+        rtype, item = unit
+        return item[2].chromosome() if rtype == SMAPRowType.InversionPartial else item[1].chromosome()
+
+    @staticmethod
+    def Shards(units, jobs: int) -> list:
+        order = sorted(range(len(units)), key=lambda i: (ShardedAnnotation.Chromosome(units[i]), i))
+        size = int(math.ceil(len(order) / jobs))
+        return [order[i:i + size] for i in range(0, len(order), size)]
+
+    @staticmethod
+    def Process(shard) -> list:
+        units, smap, reference, epsilon, fmt = ShardedAnnotation.__state
+        result = {"blocks": []}
+        with RunStats.Scope(result):
+            for i in shard:
+                block = io.StringIO()
+                OMGenomeTools.WriteAnnotationUnit(block, units[i], smap, reference, epsilon, fmt)
+                result["blocks"].append((i, block.getvalue()))
+            reference.cache().flush()
+        return result
+
+    @staticmethod
+    def Write(ostream, units, smap, reference, epsilon, jobs: int, fmt=AnnotationFormat.Text):
+        shards = ShardedAnnotation.Shards(units, jobs)
+        blocks = [None] * len(units)
+
+        #the forked workers inherit the smap and the reference data, only shard indexes and results are pickled
+        reference.preload()
+        ShardedAnnotation.__state = (units, smap, reference, epsilon, fmt)
+        try:
+            with multiprocessing.get_context("fork").Pool(len(shards)) as pool:
+                for result in pool.imap_unordered(ShardedAnnotation.Process, shards):
+                    for i, block in result["blocks"]:
+                        blocks[i] = block
+                    if "stats" in result: RunStats.Active.merge(result["stats"])
+        finally:
+            ShardedAnnotation.__state = None
+
+        for block in blocks:
+            ostream.write(block)
+
+class Cohort:
+    """
+    Annotates or filters many SMAP files on a pool of worker processes. The reference data is loaded once in the parent
+    process and inherited by forked workers copy-on-write, platforms without fork load it once per worker instead.
+    """
+    __reference = None
+
+    @staticmethod
+    def Inputs(patterns) -> list:
+        result = []
+        for pattern in patterns:
+            matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+            for path in matches:
+                if os.path.isdir(path):
+                    #outputs of an earlier filter run are not samples
+                    result.extend(sorted(os.path.join(path, f) for f in os.listdir(path) if IsSMAPPath(f) and not re.search(r"\.filtered\.smap(\.gz)?$", f, re.IGNORECASE)))
+                elif path not in result:
+                    result.append(path)
         return result
 
+    @staticmethod
+    def OutputPath(op: str, smap_path: str, output_dir: str = None, fmt=AnnotationFormat.Text) -> str:
+        suffix = fmt.suffix() if op == "annotate" else ".filtered.smap"
+        name = re.sub(r"\.smap(\.gz)?$", lambda m: suffix + (m.group(1) or ""), os.path.basename(smap_path), flags=re.IGNORECASE)
+        return os.path.join(output_dir if output_dir != None else os.path.dirname(smap_path), name)
+
+    @staticmethod
+    def Initialize(reference_paths, cache_path=None, stats=False):
+        if stats and RunStats.Active == None:
+            RunStats.Active = RunStats()
+        Cohort.__reference = ReferenceData.Load(*reference_paths)
+        Cohort.__reference.preload()
+        if cache_path != None:
+            Cohort.__reference.useCache(cache_path)
+
+    @staticmethod
+    def Process(task) -> dict:
+        op, smap_path, result_path, epsilon, fmt, mode = task
+        summary = {"sample": re.sub(r"\.smap(\.gz)?$", "", os.path.basename(smap_path), flags=re.IGNORECASE), "input": smap_path, "output": result_path,
+                   "status": "ok", "rows": 0, "common": 0, "translocations": 0, "inversions": 0, "kept": "", "seconds": 0.0}
+        started = time.perf_counter()
+        reference = Cohort.__reference
+        written = False
+
+        try:
+            with RunStats.Scope(summary):
+                if not IsSMAPPath(smap_path) or not os.path.isfile(smap_path):
+                    raise ValueError("not an existing smap file")
+
+                if op == "annotate":
+                    smap = SMAP.FromFile(smap_path, epsilon)
+                    written = True
+                    with OpenText(result_path, "w") as ostream, RunStats.Stage("annotate"):
+                        OMGenomeTools.WriteAnnotation(ostream, smap, reference, epsilon, 1, fmt)
+                    summary.update({"rows": len(smap.original()), "common": len(smap.common()),
+                                    "translocations": len(smap.translocations()), "inversions": len(smap.inversions())})
+                else:
+                    written = True
+                    with OpenText(smap_path) as instream, OpenText(result_path, "w") as outstream, RunStats.Stage("filter"):
+                        summary.update(OMGenomeTools.FilterStream(instream, outstream, reference.evidence(mode), epsilon))
+        except (SystemExit, Exception) as e:
+            #ExitWithPrint ends a single sample only, its message becomes the status and its partial output is removed
+            message = str(e)
+            summary["status"] = "error: " + (message.replace("\t", " ").replace("\n", " ") or "invalid input")
+            if written and os.path.exists(result_path):
+                os.remove(result_path)
+
+        summary["seconds"] = round(time.perf_counter() - started, 3)
+        return summary
+
+    @staticmethod
+    def Run(op: str, smap_paths, reference_paths, output_dir=None, workers=1, epsilon=10000, fmt=AnnotationFormat.Text, cache_path=None, mode=SMAPFilterType.Induced) -> list:
+        """
+        Processes every SMAP file into its own output and returns the list of per-sample summaries in input order.
+        """
+        if output_dir != None:
+            os.makedirs(output_dir, exist_ok=True)
+
+        tasks = [(op, path, Cohort.OutputPath(op, path, output_dir, fmt), epsilon, fmt, mode) for path in smap_paths]
+        outputs = {}
+        for task in tasks:
+            output = os.path.realpath(task[2])
+            if output in outputs:
+                ExitWithPrint("Samples %s and %s would both be written to %s." % (outputs[output], task[1], task[2]))
+            outputs[output] = task[1]
+        for task in tasks:
+            if os.path.realpath(task[1]) in outputs:
+                ExitWithPrint("Sample %s is the output of sample %s." % (task[1], outputs[os.path.realpath(task[1])]))
+        workers = max(1, min(workers, len(tasks)))
+
+        if workers == 1 or "fork" not in multiprocessing.get_all_start_methods():
+            if workers == 1:
+                Cohort.Initialize(reference_paths, cache_path)
+                return Cohort.MergeStats([Cohort.Process(task) for task in tasks])
+
+            with multiprocessing.get_context("spawn").Pool(workers, Cohort.Initialize, (reference_paths, cache_path, RunStats.Active != None)) as pool:
+                return Cohort.MergeStats(pool.map(Cohort.Process, tasks, chunksize=1))
+
+        Cohort.Initialize(reference_paths, cache_path)
+        with multiprocessing.get_context("fork").Pool(workers) as pool:
+            return Cohort.MergeStats(pool.map(Cohort.Process, tasks, chunksize=1))
+
+    @staticmethod
+    def MergeStats(summaries) -> list:
+        """
+        Moves the RunStats snapshots of the samples into the collector of this process.
+        """
+        for summary in summaries:
+            stats = summary.pop("stats", None)
+            if stats != None and RunStats.Active != None:
+                RunStats.Active.merge(stats)
+        return summaries
+
+    @staticmethod
+    def WriteSummary(ostream, summaries):
+        columns = ["sample", "input", "output", "status", "rows", "common", "translocations", "inversions", "kept", "seconds"]
+        ostream.write("#" + "\t".join(columns) + "\n")
+        for summary in summaries:
+            ostream.write("\t".join(str(summary[c]) for c in columns) + "\n")
+
+        failed = sum(1 for s in summaries if s["status"] != "ok")
+        ostream.write("#samples=%d failed=%d rows=%d seconds=%.3f\n" % (len(summaries), failed, sum(s["rows"] for s in summaries), sum(s["seconds"] for s in summaries)))
+
+class RunStats:
+    """
+    Stage timings and hot path counters of a run. RunStats.Active is the collector of the process, the instrumented
+    code does nothing while it is None. Stages nest, the time of an outer stage includes its inner stages.
+    """
+    Active = None
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__started = time.perf_counter()
+        self.__stages = {}
+        self.__overlaps = {}
+        self.__variants = {"common": 0, "translocations": 0, "inversions": 0}
+        self.__counters = {}
+        self.__workers_peak_rss = None
+
+    @staticmethod
+    def PeakRSS():
+        """
+        Peak resident set size of this process in bytes, None where the resource module is not available.
+        """
+        if resource == None:
+            return None
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        #ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        return usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+
+    @staticmethod
+    @contextlib.contextmanager
+    def Stage(name: str):
+        stats = RunStats.Active
+        if stats == None:
+            yield
+            return
+
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            stats.addStage(name, time.perf_counter() - wall, time.process_time() - cpu)
+
+    @staticmethod
+    @contextlib.contextmanager
+    def Scope(result: dict):
+        """
+        Collects the enclosed work of a pool task into a fresh RunStats, its snapshot is stored in result["stats"]
+        for the parent process to merge. Does nothing while the collection is off.
+        """
+        outer = RunStats.Active
+        if outer == None:
+            yield
+            return
+
+        RunStats.Active = RunStats()
+        try:
+            yield
+        finally:
+            result["stats"] = RunStats.Active.snapshot()
+            RunStats.Active = outer
+
+    def addStage(self, name: str, wall: float, cpu: float, calls: int = 1):
+        with self.__lock:
+            stage = self.__stages.setdefault(name, {"calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0})
+            stage["calls"] += calls
+            stage["wall_seconds"] += wall
+            stage["cpu_seconds"] += cpu
+
+    def addOverlaps(self, dataset: str, tests: int, hits: int):
+        with self.__lock:
+            counters = self.__overlaps.setdefault(dataset, {"tests": 0, "hits": 0})
+            counters["tests"] += tests
+            counters["hits"] += hits
+
+    def addVariants(self, common: int, translocations: int, inversions: int):
+        with self.__lock:
+            self.__variants["common"] += common
+            self.__variants["translocations"] += translocations
+            self.__variants["inversions"] += inversions
+
+    def count(self, name: str, n: int = 1):
+        with self.__lock:
+            self.__counters[name] = self.__counters.get(name, 0) + n
+
+    def merge(self, snapshot: dict):
+        """
+        Adds the counters of a snapshot taken in a worker process.
+        """
+        for name, stage in snapshot["stages"].items():
+            self.addStage(name, stage["wall_seconds"], stage["cpu_seconds"], stage["calls"])
+        for dataset, counters in snapshot["overlaps"].items():
+            self.addOverlaps(dataset, counters["tests"], counters["hits"])
+        self.addVariants(**snapshot["variants"])
+        for name, n in snapshot["counters"].items():
+            self.count(name, n)
+        with self.__lock:
+            if snapshot["peak_rss"] != None:
+                self.__workers_peak_rss = max(self.__workers_peak_rss or 0, snapshot["peak_rss"])
+
+    def snapshot(self) -> dict:
+        with self.__lock:
+            return {"wall_seconds": time.perf_counter() - self.__started,
+                    "stages": {name: dict(stage) for name, stage in self.__stages.items()},
+                    "overlaps": {dataset: dict(counters) for dataset, counters in self.__overlaps.items()},
+                    "variants": dict(self.__variants),
+                    "counters": dict(self.__counters),
+                    "peak_rss": RunStats.PeakRSS(),
+                    "workers_peak_rss": self.__workers_peak_rss}
+
+    @staticmethod
+    def Write(ostream, snapshot: dict):
+        def size(value):
+            return "-" if value == None else "%.1f MB" % (value / 1e6)
+
+        ostream.write("#stage\tcalls\twall_seconds\tcpu_seconds\n")
+        for name, stage in sorted(snapshot["stages"].items(), key=lambda s: -s[1]["wall_seconds"]):
+            ostream.write("%s\t%d\t%.3f\t%.3f\n" % (name, stage["calls"], stage["wall_seconds"], stage["cpu_seconds"]))
+        ostream.write("#dataset\toverlap_tests\thits\n")
+        for dataset, counters in sorted(snapshot["overlaps"].items()):
+            ostream.write("%s\t%d\t%d\n" % (dataset, counters["tests"], counters["hits"]))
+        ostream.write("#variants\t" + "\t".join("%s=%d" % v for v in snapshot["variants"].items()) + "\n")
+        if len(snapshot["counters"]) > 0:
+            ostream.write("#counters\t" + "\t".join("%s=%d" % c for c in sorted(snapshot["counters"].items())) + "\n")
+        ostream.write("#wall_seconds=%.3f peak_rss=%s workers_peak_rss=%s\n" % (snapshot["wall_seconds"], size(snapshot["peak_rss"]), size(snapshot["workers_peak_rss"])))
+
+class TimedWriter:
+    """
+    Output stream wrapper adding the time spent in write calls to the "write output" stage of RunStats.
+    """
+    def __init__(self, stream, stats: 'RunStats'):
+        self.__stream = stream
+        self.__stats = stats
+        self.__wall = 0.0
+        self.__cpu = 0.0
+        self.__calls = 0
+
+    def write(self, text: str):
+        wall, cpu = time.perf_counter(), time.process_time()
+        self.__stream.write(text)
+        self.__wall += time.perf_counter() - wall
+        self.__cpu += time.process_time() - cpu
+        self.__calls += 1
+
+    def flush(self):
+        self.__stream.flush()
+
+    def close(self):
+        wall, cpu = time.perf_counter(), time.process_time()
+        self.__stream.close()
+        self.__stats.addStage("write output", self.__wall + time.perf_counter() - wall, self.__cpu + time.process_time() - cpu, self.__calls)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class ServerStats:
+    """
+    Thread-safe latency and throughput counters of the query server, one entry per endpoint.
+    """
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__started = time.time()
+        self.__endpoints = {}
+
+    def record(self, endpoint: str, seconds: float, ok: bool):
+        with self.__lock:
+            counters = self.__endpoints.setdefault(endpoint, {"requests": 0, "errors": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+            counters["requests"] += 1
+            counters["errors"] += 0 if ok else 1
+            counters["total_seconds"] += seconds
+            counters["max_seconds"] = max(counters["max_seconds"], seconds)
+
+    def snapshot(self) -> dict:
+        with self.__lock:
+            uptime = time.time() - self.__started
+            endpoints = {}
+            for endpoint, counters in self.__endpoints.items():
+                endpoints[endpoint] = {"requests": counters["requests"],
+                                       "errors": counters["errors"],
+                                       "mean_ms": 1000 * counters["total_seconds"] / counters["requests"],
+                                       "max_ms": 1000 * counters["max_seconds"],
+                                       "requests_per_second": counters["requests"] / uptime if uptime > 0 else 0.0}
+            return {"uptime_seconds": uptime, "requests": sum(e["requests"] for e in endpoints.values()), "endpoints": endpoints}
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+class QueryServer:
+    """
+    Keeps the reference data loaded and answers view, annotate and filter requests through a local JSON API:
+        GET  /view?region=chr1:1000-2000   or POST /view {"region": "chr1:1000-2000"}
+        POST /annotate {"smap": "<smap file content>", "distance": 10000, "format": "text|tsv|jsonl"}
+        POST /filter   {"smap": "<smap file content>", "distance": 10000, "mode": "induced|mapping|both"}
+        GET  /stats
+    Every response is a json object, results are returned as {"result": "<text>"}.
+    """
+    Endpoints = ["view", "annotate", "filter", "stats"]
+
+    def __init__(self, reference: 'ReferenceData', epsilon=10000):
+        self.__reference = reference
+        self.__epsilon = epsilon
+        self.__stats = ServerStats()
+
+    def stats(self) -> 'ServerStats':
+        return self.__stats
+
+    def handle(self, endpoint: str, request) -> dict:
+        out = io.StringIO()
+        distance = int(request.get("distance", self.__epsilon))
+
+        if endpoint == "stats":
+            snapshot = self.__stats.snapshot()
+            if RunStats.Active != None:
+                snapshot["run"] = RunStats.Active.snapshot()
+            return snapshot
+
+        with RunStats.Stage(endpoint):
+            self.__handle(endpoint, request, out, distance)
+        return {"result": out.getvalue()}
+
+    def __handle(self, endpoint: str, request, out, distance: int):
+        if endpoint == "view":
+            OMGenomeTools.WriteView(out, Position.FromString(request["region"]), self.__reference)
+        elif endpoint == "annotate":
+            smap = SMAP.FromStream(io.StringIO(request["smap"]), distance)
+            OMGenomeTools.WriteAnnotation(out, smap, self.__reference, distance, 1, AnnotationFormat.FromName(request.get("format", "text")))
+        elif endpoint == "filter":
+            mode = SMAPFilterType.FromName(request.get("mode", "induced"))
+            OMGenomeTools.FilterStream(io.StringIO(request["smap"]), out, self.__reference.evidence(mode), distance)
+
+    def dispatch(self, endpoint: str, request):
+        """
+        Returns the http status and the json response for a request, failures are counted by the stats.
+        """
+        if endpoint not in QueryServer.Endpoints:
+            return (404, {"error": "Unknown endpoint, use one of: " + ", ".join(QueryServer.Endpoints)})
+
+        started = time.perf_counter()
+        status = 200
+        try:
+            response = self.handle(endpoint, request)
+        except KeyError as e:
+            status, response = 400, {"error": "Missing request field %s." % e}
+        except ValueError as e:
+            status, response = 400, {"error": "Invalid request data: %s." % e}
+        except SystemExit as e:
+            #invalid positions and smap rows end in ExitWithPrint
+            status, response = 400, {"error": "Invalid request data: %s" % e}
+        except Exception as e:
+            status, response = 500, {"error": str(e)}
+
+        if endpoint != "stats":
+            self.__stats.record(endpoint, time.perf_counter() - started, status == 200)
+        return (status, response)
+
+    def serve(self, host="127.0.0.1", port=8013, socket_path=None):
+        query_server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def respond(self, endpoint, request):
+                status, response = query_server.dispatch(endpoint, request)
+                body = json.dumps(response).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                url = urllib.parse.urlparse(self.path)
+                request = {k: v[-1] for k, v in urllib.parse.parse_qs(url.query).items()}
+                self.respond(url.path.strip("/"), request)
+
+            def do_POST(self):
+                url = urllib.parse.urlparse(self.path)
+                length = int(self.headers.get("Content-Length", 0))
+                try:
+                    request = json.loads(self.rfile.read(length) or b"{}")
+                except ValueError:
+                    request = None
+                if not isinstance(request, dict):
+                    self.respond("", {})
+                    return
+                self.respond(url.path.strip("/"), request)
+
+            def log_message(self, format, *args):
+                pass
+
+        if socket_path != None:
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+            httpd = ThreadingUnixHTTPServer(socket_path, Handler)
+            print("Serving om38to13 on unix socket", socket_path)
+        else:
+            httpd = http.server.ThreadingHTTPServer((host, port), Handler)
+            print("Serving om38to13 on http://%s:%d" % (host, port))
+
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            httpd.server_close()
+
 def run(args):    
     op = args.op
-    input = args.input
+    inputs = args.input
+    input = inputs[0] if len(inputs) > 0 else None
+    args.input = input
 
     default_datadir = "data/"
     if args.data_dir != None:
@@ -429,19 +2600,77 @@ def run(args):
                 default_datadir += "/"
     
     #verify the input and op correctness
-    if op in ["annotate" ,"filter"]:
-        if not input.lower().endswith(".smap"):
+    if op not in ["compile", "serve"] and input == None:
+        ExitWithPrint("The %s command requires an input." % op)
+
+    variants = args.datasets.split(",")
+    for variant in variants:
+        if variant not in ReferenceData.Variants:
+            ExitWithPrint("Unknown dataset %s, use a comma separated list of: %s." % (variant, ", ".join(ReferenceData.Variants)))
+    reference_paths = ReferenceData.Paths(default_datadir, variants)
+    mode = SMAPFilterType.FromName(args.mode)
+    cohort = op in ["annotate", "filter"] and (len(inputs) > 1 or args.workers != None or glob.has_magic(input) or os.path.isdir(input))
+
+    if cohort:
+        summaries = Cohort.Run(op, Cohort.Inputs(inputs), reference_paths, args.output, args.workers or 1, args.distance, AnnotationFormat.FromName(args.format), args.cache, mode)
+        if args.summary == None:
+            Cohort.WriteSummary(sys.stdout, summaries)
+        else:
+            with open(args.summary, "w") as f:
+                Cohort.WriteSummary(f, summaries)
+    elif op in ["annotate" ,"filter"]:
+        if not IsSMAPPath(input) and not (op == "filter" and input == "-"):
             ExitWithPrint("Annotate and filter commands requires smap file as input.")            
         if op == "annotate":
             if args.output == None:
-                args.output = args.input.replace(".smap",".annotated.txt")
-            OMGenomeTools.Annotate(args.input, default_datadir + "fromHG38toCHM13-alignments", default_datadir + "fromCHM13toHG38-alignments", default_datadir + "prediction_38.bed", args.output, args.distance)
+                args.output = Cohort.OutputPath(op, args.input, None, AnnotationFormat.FromName(args.format))
+            g12, g21, pred, others = reference_paths
+            OMGenomeTools.Annotate(args.input, g12, g21, pred, args.output, args.distance, args.jobs, AnnotationFormat.FromName(args.format), args.cache, others)
         elif op == "filter":
             if args.output == None:
-                args.output = args.input.replace(".smap",".filtered.smap")
-            OMGenomeTools.Filter(args.input, None, default_datadir + "fromHG38toCHM13-alignments", default_datadir + "fromCHM13toHG38-alignments", default_datadir + "prediction_38.bed", args.output, args.distance)
+                args.output = "-" if args.input == "-" else Cohort.OutputPath(op, args.input)
+            g12, g21, pred, others = reference_paths
+            OMGenomeTools.Filter(args.input, mode, g12, g21, pred, args.output, args.distance, others)
+    elif op == "serve":
+        reference = ReferenceData.Load(*reference_paths)
+        if args.cache != None:
+            reference.useCache(args.cache)
+        QueryServer(reference, args.distance).serve(args.host, args.port, args.socket)
+    elif op == "liftover":
+        reference = ReferenceData.Load(*reference_paths)
+        instream = sys.stdin if input == "-" else OpenText(input)
+        outstream = sys.stdout if args.output == None or args.output == "-" else OpenText(args.output, "w")
+        with RunStats.Stage("liftover"):
+            Liftover(reference, args.reverse).write(Liftover.ReadPositions(instream, IsSMAPPath(input)), outstream)
+        if instream is not sys.stdin: instream.close()
+        if outstream is not sys.stdout: outstream.close()
+    elif op == "index":
+        if not IsSMAPPath(input):
+            ExitWithPrint("The index command requires smap file as input.")
+        SMAPIndex.Build(input)
+        print("Indexed:", SMAPIndex.IndexPath(input))
+    elif op == "query":
+        if not IsSMAPPath(input) or len(inputs) < 2:
+            ExitWithPrint("The query command requires smap file and at least one region as input.")
+        index = SMAPIndex.Load(input) or SMAPIndex.Build(input, False)
+        outstream = sys.stdout if args.output == None or args.output == "-" else OpenText(args.output, "w")
+        outstream.write("".join(line + "\n" for line in index.header()))
+        offsets = sorted(set(itertools.chain.from_iterable(index.offsets(Position.FromString(region)) for region in inputs[1:])))
+        for line in index.rows(offsets):
+            outstream.write(line + "\n")
+        if outstream is not sys.stdout: outstream.close()
+    elif op == "compile":
+        print("Compiled reference bundle:", ReferenceBundle.Compile(default_datadir))
+    elif op == "view" and (args.input == "-" or os.path.isfile(args.input)):
+        reference = ReferenceData.Load(*reference_paths)
+        instream = sys.stdin if args.input == "-" else OpenText(args.input)
+        outstream = sys.stdout if args.output == None or args.output == "-" else OpenText(args.output, "w")
+        with RunStats.Stage("view"):
+            OMGenomeTools.ViewBatch(OMGenomeTools.ReadRegions(instream), reference, outstream)
+        if instream is not sys.stdin: instream.close()
+        if outstream is not sys.stdout: outstream.close()
     elif op == "view":
-        OMGenomeTools.View(args.input, default_datadir + "fromHG38toCHM13-alignments", default_datadir + "fromCHM13toHG38-alignments", default_datadir + "prediction_38.bed")
+        OMGenomeTools.View(args.input, *reference_paths[:3])
         
 
     #OMGenomeTools.DoWork(args.input, "data/fromHG38toCHM13-alignments", "data/fromCHM13toHG38-alignments", "data/prediction_hg38.bed", args.output)
@@ -454,13 +2683,50 @@ if __name__ == "__main__":
     
     parser = argparse.ArgumentParser(prog="om38to13", description="The program for providing additional information to structural variants found by Bionano software tools. For more details please refer to README.txt file.")
     
-    parser.add_argument("op", choices=["annotate","filter","view"], help="Select one of the supported operations annotate, filter or view")
-    parser.add_argument("input", help="Specify path to the smap file for annotate and filter commands or a region in a standard genomic location format for view command: e.g. chr1:1000, chr2:1000-2000")
+    parser.add_argument("op", choices=["annotate","filter","view","liftover","index","query","compile","serve"], help="Select one of the supported operations annotate, filter, view, index (builds a region index of a smap file), query (prints the smap rows overlapping regions), liftover (translates BED, region or smap positions between HG38 and CHM13), compile (precompiles the data directory into a binary bundle) or serve (local JSON API keeping the data loaded)")
+    parser.add_argument("input", nargs="*", help="Specify path to the smap file for annotate and filter commands (- reads stdin for filter; several files, globs or directories process a cohort) or a region in a standard genomic location format for view command: e.g. chr1:1000, chr2:1000-2000, a BED file or a file with one region per line (- reads stdin) runs a batch view with TSV output")
     parser.add_argument("-d", "--distance", type=int, default=10000, help="Specify the distance for acceptation of translocation. It is a distance from the translocation breakpoint.")
-    parser.add_argument("-o", "--output", help="Specify the output file path, if not provided, .smap will be replaced by .filter.smap or .annotated.smap")    
+    parser.add_argument("-o", "--output", help="Specify the output file path (- writes to stdout), if not provided, .smap will be replaced by .filter.smap or .annotated.smap")    
     parser.add_argument("-w", "--data_dir", help="Specify directory with default data")
+    parser.add_argument("--workers", type=int, help="Specify the number of worker processes for annotate and filter of several smap files, -o is then the output directory")
+    parser.add_argument("-f", "--format", choices=["text","tsv","jsonl"], default="text", help="Specify the annotation output format, text layout, TSV with one line per event or JSON Lines with one object per variant")
+    parser.add_argument("-r", "--reverse", action="store_true", help="Specify that liftover translates CHM13 positions to HG38")
+    parser.add_argument("--jobs", type=int, default=1, help="Specify the number of processes annotating the variants of a single smap file, split by chromosome")
+    parser.add_argument("--datasets", default="alignments", help="Specify a comma separated list of the mapping datasets of the data directory: base, alignments, assemblies. The first one is used by view and liftover, annotate reports the events of all of them and filter checks all of them in the mapping mode")
+    parser.add_argument("-m", "--mode", choices=["induced","mapping","both"], default="induced", help="Specify which variants filter removes: overlapping predicted induced variants, overlapping ambiguous or missing mappings of the datasets, or both")
+    parser.add_argument("--cache", help="Specify a SQLite file keeping annotation results of intervals across runs and samples")
+    parser.add_argument("--summary", help="Specify the path of the cohort summary, printed to the console if not provided")
+    parser.add_argument("--stats", nargs="?", const="-", help="Report the wall and CPU time of the processing stages, overlap tests and hits per dataset, variant counts and peak RSS to stderr or to the given file (JSON for .json paths), the serve command adds them to /stats")
+    parser.add_argument("--profile", help="Run under cProfile and dump the pstats file to the given path, - prints the top functions to stderr")
+    parser.add_argument("--host", default="127.0.0.1", help="Specify the address the serve command listens on")
+    parser.add_argument("--port", type=int, default=8013, help="Specify the port the serve command listens on")
+    parser.add_argument("--socket", help="Specify a unix socket path the serve command listens on instead of host and port")
     
-    args = parser.parse_args()    
+    args = parser.parse_intermixed_args()
+
+    if args.stats != None:
+        RunStats.Active = RunStats()
+    profiler = cProfile.Profile() if args.profile != None else None
 
-    run(args)
+    try:
+        if profiler != None:
+            profiler.runcall(run, args)
+        else:
+            run(args)
+    finally:
+        if profiler != None:
+            if args.profile == "-":
+                pstats.Stats(profiler, stream=sys.stderr).sort_stats("cumulative").print_stats(30)
+            else:
+                profiler.dump_stats(args.profile)
+        if args.stats != None:
+            snapshot = RunStats.Active.snapshot()
+            if args.stats == "-":
+                RunStats.Write(sys.stderr, snapshot)
+            else:
+                with open(args.stats, "w") as f:
+                    if args.stats.lower().endswith(".json"):
+                        json.dump(snapshot, f, indent=2)
+                    else:
+                        RunStats.Write(f, snapshot)
     exit(0)
\ No newline at end of file